@@ -17,19 +17,27 @@ have type that begins with sliver.
 There are any number of race conditions that may result from the fact
 that account names are not unique over time.  Moreover, it's a bad
 idea to perform lengthy operations while holding the database lock.
-In order to deal with both of these problems, we use a worker thread
-for each account name that ever exists.  On 32-bit systems with large
-numbers of accounts, this may cause the NM process to run out of
-*virtual* memory!  This problem may be remedied by decreasing the
-maximum stack size.
+In order to deal with both of these problems, each account name that
+ever exists gets a Worker, with a queue of pending operations: the
+Worker methods that change anything just queue the operation and
+return.  The queued operations are run by a bounded pool of threads,
+one operation at a time for a given account, in the order they were
+requested.  Creations, destructions and starts are heavy on the node,
+so the number of each that may run at the same time is further
+limited; see set_concurrency().
 """
 
 import os
-import pwd, grp
+import sys
+import stat
+import time
 import threading
 
 import logger
 import tools
+import pwdcache
+import cyclestats
+import sliverpool
 
 
 # shell path -> account class association
@@ -37,9 +45,14 @@ shell_acct_class = {}
 # account type -> account class association
 type_acct_class = {}
 
-# these semaphores are acquired before creating/destroying an account
-create_sem = threading.Semaphore(1)
-destroy_sem = threading.Semaphore(1)
+# how many account operations run at the same time
+DEFAULT_JOBS = 4
+# how many of them may be creations, destructions, or starts
+DEFAULT_LIMITS = {'create': 1, 'destroy': 1, 'start': 2}
+
+# kind of operation -> semaphore acquired while running one
+limits = {}
+for (kind, limit) in DEFAULT_LIMITS.items(): limits[kind] = threading.Semaphore(limit)
 
 def register_class(acct_class):
     """Call once for each account class. This method adds the class
@@ -49,12 +62,103 @@ type."""
     type_acct_class[acct_class.TYPE] = acct_class
 
 
+# called with the account name once a sliver has been started, from the worker's thread
+started_callbacks = []
+# same, once an operation on a sliver has failed
+failed_callbacks = []
+
 # private account name -> worker object association and associated lock
 name_worker_lock = threading.Lock()
 name_worker = {}
 
+def set_concurrency(jobs, kind_limits={}):
+    """Run up to <jobs> account operations at the same time; <kind_limits>
+maps 'create', 'destroy' or 'start' to how many of these may run at once.
+To be called before anything gets queued."""
+    pool.size = jobs
+    for (kind, limit) in kind_limits.items():
+        if kind not in DEFAULT_LIMITS: raise ValueError("unknown kind of operation %r" % kind)
+        limits[kind] = threading.Semaphore(limit)
+    logger.verbose("accounts: running %d operations at a time, limits %r" % (jobs, kind_limits))
+
+def limited(kind, function, *args):
+    """Call <function>, once there are not too many operations of that <kind> running"""
+    limits[kind].acquire()
+    try: return function(*args)
+    finally: limits[kind].release()
+
+
+class Pool:
+    """A bounded number of threads that run the operations queued in the workers"""
+
+    def __init__(self, size):
+        self.size = size
+        self.cond = threading.Condition()
+        # workers with pending operations, that are not being run
+        self.ready = []
+        # workers that are either ready or being run
+        self.scheduled = 0
+        self.threads = 0
+
+    def schedule(self, worker):
+        self.cond.acquire()
+        try:
+            self.ready.append(worker)
+            self.scheduled += 1
+            # threads are started as needed
+            if self.threads < self.size and self.threads < self.scheduled:
+                self.threads += 1
+                tools.as_daemon_thread(self.run)
+            self.cond.notify()
+        finally: self.cond.release()
+
+    def done(self, worker):
+        self.cond.acquire()
+        try:
+            self.scheduled -= 1
+            self.cond.notifyAll()
+        finally: self.cond.release()
+
+    def run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.ready: self.cond.wait()
+                worker = self.ready.pop(0)
+            finally: self.cond.release()
+            worker.run_next()
+
+    def wait(self, timeout=None):
+        """Wait until all queued operations have been run, or for <timeout> seconds; return whether they have"""
+        self.cond.acquire()
+        try:
+            if timeout is not None: deadline = time.time() + timeout
+            while self.scheduled:
+                if timeout is None: self.cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0: break
+                    self.cond.wait(remaining)
+            return not self.scheduled
+        finally: self.cond.release()
+
+    def pending(self):
+        """The number of workers with queued operations"""
+        self.cond.acquire()
+        try: return self.scheduled
+        finally: self.cond.release()
+
+pool = Pool(DEFAULT_JOBS)
+
+def wait(timeout=None):
+    return pool.wait(timeout)
+
+
 def allpwents():
-    return [pw_ent for pw_ent in pwd.getpwall() if pw_ent[6] in shell_acct_class]
+    pw_ents = []
+    for shell in shell_acct_class: pw_ents += pwdcache.getpwshell(shell)
+    # the vservers kept ready by sliverpool are not slivers yet
+    return [ pw_ent for pw_ent in pw_ents if not sliverpool.owns(pw_ent[0]) ]
 
 def all():
     """Return the names of all accounts on the system with recognized shells."""
@@ -68,6 +172,52 @@ def get(name):
         return name_worker[name]
     finally: name_worker_lock.release()
 
+def sweep():
+    """Forget the workers that have nothing to do and no account object,
+e.g. those of destroyed accounts, so that the registry does not grow
+forever; return how many were evicted."""
+    name_worker_lock.acquire()
+    try:
+        evicted = 0
+        for (name, worker) in name_worker.items():
+            if worker.evict():
+                del name_worker[name]
+                evicted += 1
+        size = len(name_worker)
+        memory = registry_bytes()
+    finally: name_worker_lock.release()
+    if evicted: logger.verbose("accounts: evicted %d idle workers" % evicted)
+    cyclestats.set_value('accounts.workers', size)
+    cyclestats.incr('accounts.workers.evicted', evicted)
+    if memory is not None: cyclestats.set_value('accounts.workers.bytes', memory)
+    return evicted
+
+def registry_bytes():
+    """A rough estimate of the memory held by the registry, or None if it cannot be measured.
+To be called with name_worker_lock held."""
+    if not hasattr(sys, 'getsizeof'): return None
+    total = sys.getsizeof(name_worker)
+    for worker in name_worker.itervalues():
+        total += sys.getsizeof(worker) + sys.getsizeof(worker.__dict__)
+        if worker._acct is not None:
+            attributes = worker._acct.__dict__
+            total += sys.getsizeof(worker._acct) + sys.getsizeof(attributes)
+            for value in attributes.itervalues(): total += sys.getsizeof(value)
+    return total
+
+
+def keys_installed(auth_keys, keys, uid, gid):
+    """Whether file <auth_keys> already holds <keys>, with the expected mode and ownership."""
+    try: st = os.stat(auth_keys)
+    except OSError: return False
+    if st.st_size != len(keys) or stat.S_IMODE(st.st_mode) != 0600 or (st.st_uid, st.st_gid) != (uid, gid):
+        return False
+    try:
+        f = open(auth_keys)
+        try: return f.read() == keys
+        finally: f.close()
+    except IOError: return False
+
 
 class Account:
     def __init__(self, rec):
@@ -88,14 +238,22 @@ class Account:
         new_keys = rec['keys']
         if new_keys != self.keys:
             # get the unix account info
-            gid = grp.getgrnam("slices")[2]
-            pw_info = pwd.getpwnam(self.name)
+            gid = pwdcache.getgrnam("slices")[2]
+            pw_info = pwdcache.getpwnam(self.name)
             uid = pw_info[2]
             pw_dir = pw_info[5]
+            dot_ssh = os.path.join(pw_dir,'.ssh')
+            auth_keys = os.path.join(dot_ssh,'authorized_keys')
+
+            # self.keys is empty for a new object, e.g. after a restart:
+            # most of the time the file is up to date already
+            if keys_installed(auth_keys, new_keys, uid, gid):
+                self.keys = new_keys
+                logger.verbose('accounts: %s: ssh keys already installed' % self.name)
+                return
 
             # write out authorized_keys file and conditionally create
             # the .ssh subdir if need be.
-            dot_ssh = os.path.join(pw_dir,'.ssh')
             if not os.path.isdir(dot_ssh):
                 if not os.path.isdir(pw_dir):
                     logger.verbose('accounts: WARNING: homedir %s does not exist for %s!'%(pw_dir,self.name))
@@ -103,14 +261,13 @@ class Account:
                     os.chown(pw_dir, uid, gid)
                 os.mkdir(dot_ssh)
 
-            auth_keys = os.path.join(dot_ssh,'authorized_keys')
-            tools.write_file(auth_keys, lambda f: f.write(new_keys))
+            # the temporary file gets its permissions and ownership before it is renamed
+            tools.write_file(auth_keys, lambda f: f.write(new_keys), mode=0600, uidgid=(uid, gid))
 
             # set access permissions and ownership properly
-            os.chmod(dot_ssh, 0700)
-            os.chown(dot_ssh, uid, gid)
-            os.chmod(auth_keys, 0600)
-            os.chown(auth_keys, uid, gid)
+            st = os.stat(dot_ssh)
+            if stat.S_IMODE(st.st_mode) != 0700: os.chmod(dot_ssh, 0700)
+            if (st.st_uid, st.st_gid) != (uid, gid): os.chown(dot_ssh, uid, gid)
 
             # set self.keys to new_keys only when all of the above ops succeed
             self.keys = new_keys
@@ -126,8 +283,79 @@ class Worker:
     def __init__(self, name):
         self.name = name  # username
         self._acct = None  # the account object currently associated with this worker
-
-    def ensure_created(self, rec):
+        self.lock = threading.Lock()
+        # operations to run, as (name, method, args)
+        self.queue = []
+        # whether this worker is in the pool, ready or running
+        self.scheduled = False
+        # whether sweep() removed this worker from the registry
+        self.evicted = False
+
+    def evict(self):
+        """Mark this worker as evicted, if it is idle and has no account object; return whether it was.
+Called by sweep() with name_worker_lock held."""
+        self.lock.acquire()
+        try:
+            if self.queue or self.scheduled or self._acct is not None: return False
+            self.evicted = True
+            return True
+        finally: self.lock.release()
+
+    def _queue(self, operation, method, *args):
+        self.lock.acquire()
+        try:
+            evicted = self.evicted
+            if not evicted:
+                # only the latest record matters
+                if operation == 'ensure_created' and self.queue and self.queue[-1][0] == operation:
+                    self.queue[-1] = (operation, method, args)
+                    logger.verbose("accounts: %s: pending ensure_created superseded" % self.name)
+                    return
+                self.queue.append((operation, method, args))
+                if self.scheduled: return
+                self.scheduled = True
+        finally: self.lock.release()
+        if evicted:
+            # got evicted since it was returned by get(): hand over to the current worker
+            worker = get(self.name)
+            worker._queue(operation, getattr(worker, method.__name__), *args)
+            return
+        pool.schedule(self)
+
+    def run_next(self):
+        """Run the first queued operation - called from a pool thread"""
+        self.lock.acquire()
+        try: (operation, method, args) = self.queue.pop(0)
+        finally: self.lock.release()
+        try: method(*args)
+        except:
+            logger.log_exc("accounts: %s failed" % operation, name=self.name)
+            for callback in failed_callbacks:
+                try: callback(self.name)
+                except: logger.log_exc("accounts: failure callback failed", name=self.name)
+        self.lock.acquire()
+        try:
+            more = bool(self.queue)
+            if not more: self.scheduled = False
+        finally: self.lock.release()
+        # let the other workers have their turn
+        if more: pool.schedule(self)
+        pool.done(self)
+
+    def pending(self):
+        """The names of the operations waiting to run"""
+        self.lock.acquire()
+        try: return [ operation for (operation, method, args) in self.queue ]
+        finally: self.lock.release()
+
+    # these queue the operation and return; the record is copied, as the database may change in the meantime
+    def ensure_created(self, rec): self._queue('ensure_created', self._ensure_created, rec.copy())
+    def ensure_destroyed(self): self._queue('ensure_destroyed', self._ensure_destroyed)
+    def start(self, rec, d = 0): self._queue('start', self._start, rec.copy(), d)
+    def configure(self, rec): self._queue('configure', self._configure, rec.copy())
+    def stop(self): self._queue('stop', self._stop)
+
+    def _ensure_created(self, rec):
         """Check account type is still valid.  If not, recreate sliver.
 If still valid, check if running and configure/start if not."""
         logger.log_data_in_file(rec,"/var/lib/nodemanager/%s.rec.txt"%rec['name'],
@@ -136,9 +364,8 @@ If still valid, check if running and configure/start if not."""
         next_class = type_acct_class[rec['type']]
         if next_class != curr_class:
             self._destroy(curr_class)
-            create_sem.acquire()
-            try: next_class.create(self.name, rec)
-            finally: create_sem.release()
+            limited('create', next_class.create, self.name, rec)
+            pwdcache.invalidate()
         if not isinstance(self._acct, next_class): self._acct = next_class(rec)
         logger.verbose("accounts.ensure_created: %s, running=%r"%(self.name,self.is_running()))
 
@@ -147,29 +374,32 @@ If still valid, check if running and configure/start if not."""
             # reservable nodes
             if rec['reservation_alive']:
                 # this sliver has the lease, it is safe to start it
-                if not self.is_running(): self.start(rec)
-                else: self.configure(rec)
+                if not self.is_running(): self._start(rec)
+                else: self._configure(rec)
             else:
                 # not having the lease, do not start it
-                self.configure(rec)
+                self._configure(rec)
         # usual nodes - preserve old code
         # xxx it's not clear what to do when a sliver changes type/class
         # in a reservable node
         else:
             if not self.is_running() or next_class != curr_class:
-                self.start(rec)
-            else: self.configure(rec)
+                self._start(rec)
+            else: self._configure(rec)
 
-    def ensure_destroyed(self): self._destroy(self._get_class())
+    def _ensure_destroyed(self): self._destroy(self._get_class())
 
-    def start(self, rec, d = 0):
+    def _start(self, rec, d = 0):
         self._acct.configure(rec)
-        self._acct.start(delay=d)
+        limited('start', self._acct.start, d)
+        for callback in started_callbacks:
+            try: callback(self.name)
+            except: logger.log_exc("accounts: start callback failed", name=self.name)
 
-    def configure(self, rec):
+    def _configure(self, rec):
         self._acct.configure(rec)
 
-    def stop(self): self._acct.stop()
+    def _stop(self): self._acct.stop()
 
     def is_running(self):
         if (self._acct != None) and self._acct.is_running():
@@ -182,11 +412,10 @@ If still valid, check if running and configure/start if not."""
     def _destroy(self, curr_class):
         self._acct = None
         if curr_class:
-            destroy_sem.acquire()
-            try: curr_class.destroy(self.name)
-            finally: destroy_sem.release()
+            limited('destroy', curr_class.destroy, self.name)
+            pwdcache.invalidate()
 
     def _get_class(self):
-        try: shell = pwd.getpwnam(self.name)[6]
+        try: shell = pwdcache.getpwnam(self.name)[6]
         except KeyError: return None
         return shell_acct_class[shell]
@@ -13,7 +13,6 @@ import SimpleXMLRPCServer
 import SocketServer
 import errno
 import os
-import pwd
 import socket
 import struct
 import threading
@@ -22,6 +21,7 @@ import sys
 
 import accounts
 import database
+import pwdcache
 import sliver_vs
 import ticket
 import tools
@@ -45,9 +45,16 @@ class APIRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
     # duplicating SimpleXMLRPCServer code here, which is more likely to
     # change than the deprecated behavior is to be broken
 
-    @database.synchronized
     def _dispatch(self, method_name_unicode, args):
         method_name = str(method_name_unicode)
+        if method_name in readonly_methods:
+            # no need to wait for a sync to complete, the snapshot is consistent and does not change
+            return self._dispatch_in(database.snapshot(), method_name, args)
+        database.db_lock.acquire()
+        try: return self._dispatch_in(database.db, method_name, args)
+        finally: database.db_lock.release()
+
+    def _dispatch_in(self, db, method_name, args):
         try: method = api_method_dict[method_name]
         except KeyError:
             api_method_list = api_method_dict.keys()
@@ -65,13 +72,13 @@ class APIRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
             sizeof_struct_ucred = 12
             ucred = self.request.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, sizeof_struct_ucred)
             xid = struct.unpack('3i', ucred)[1]
-            caller_name = pwd.getpwuid(xid)[0]
+            caller_name = pwdcache.getpwuid(xid)[0]
             # Special case : the sfa component manager
             if caller_name == PLC_SLICE_PREFIX+"_sfacm":
                 try: result = method(*args)
                 except Exception, err: raise xmlrpclib.Fault(104, 'Error in call: %s' %err)
             # Anyone can call these functions
-            elif method_name in ('Help', 'Ticket', 'GetXIDs', 'GetSSHKeys'):
+            elif method_name in ('Help', 'Ticket', 'GetXIDs', 'GetSSHKeys', 'SyncNow'):
                 try: result = method(*args)
                 except Exception, err: raise xmlrpclib.Fault(104, 'Error in call: %s' %err)
             else: # Execute anonymous call.
@@ -82,7 +89,7 @@ class APIRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
                     target_name = args[0]
 
                 # Gather target slice's object.
-                target_rec = database.db.get(target_name)
+                target_rec = db.get(target_name)
 
                 # only work on slivers or self. Sanity check.
                 if not (target_rec and target_rec['type'].startswith('sliver.')):
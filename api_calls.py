@@ -13,7 +13,6 @@ import SimpleXMLRPCServer
 import SocketServer
 import errno
 import os
-import pwd
 import socket
 import struct
 import threading
@@ -28,6 +27,8 @@ except:
 
 import accounts
 import logger
+import pwdcache
+import sliverpool
 
 # TODO: These try/excepts are a hack to allow doc/DocBookLocal.py to
 # import this file in order to extract the documentation from each
@@ -39,16 +40,20 @@ try: import sliver_vs
 except: import logger as sliver_vs
 import ticket as ticket_module
 import tools
+import synctrigger
 
 deliver_ticket = None  # set in slivermanager.start()
 
 api_method_dict = {}
 nargs_dict = {}
+# methods that do not change anything; they are served from the latest database snapshot
+readonly_methods = set()
 
-def export_to_api(nargs):
+def export_to_api(nargs, readonly=False):
     def export(method):
         nargs_dict[method.__name__] = nargs
         api_method_dict[method.__name__] = method
+        if readonly: readonly_methods.add(method.__name__)
         return method
     return export
 
@@ -95,7 +100,7 @@ def export_to_docbook(**kwargs):
 @export_to_docbook(roles=['self'],
                    accepts=[],
                    returns=Parameter([], 'A list of supported functions'))
-@export_to_api(0)
+@export_to_api(0, readonly=True)
 def Help():
     """Get a list of functions currently supported by the Node Manager API"""
     names=api_method_dict.keys()
@@ -144,24 +149,36 @@ def AdminTicket(ticket):
 @export_to_docbook(roles=['self'],
                    accepts=[],
                    returns={'sliver_name' : Parameter(int, 'the associated xid')})
-@export_to_api(0)
+@export_to_api(0, readonly=True)
 def GetXIDs():
     """Return an dictionary mapping Slice names to XIDs"""
-    return dict([(pwent[0], pwent[2]) for pwent in pwd.getpwall() if pwent[6] == sliver_vs.Sliver_VS.SHELL])
+    return dict([(pwent[0], pwent[2]) for pwent in pwdcache.getpwshell(sliver_vs.Sliver_VS.SHELL)
+                 if not sliverpool.owns(pwent[0])])
 
 @export_to_docbook(roles=['self'],
                    accepts=[],
                    returns={ 'sliver_name' : Parameter(str, 'the associated SSHKey')})
-@export_to_api(0)
+@export_to_api(0, readonly=True)
 def GetSSHKeys():
     """Return an dictionary mapping slice names to SSH keys"""
     keydict = {}
-    for rec in database.db.itervalues():
+    for rec in database.snapshot().itervalues():
         if 'keys' in rec:
             keydict[rec['name']] = rec['keys']
     return keydict
 
 
+@export_to_docbook(roles=['self'],
+                   accepts=[],
+                   returns=Parameter(int, '1 if successful'))
+@export_to_api(0, readonly=True)
+def SyncNow():
+    """Request the Node Manager to sync with PLC as soon as possible,
+    instead of waiting for its next polling period. Requests made within
+    a short interval are merged into a single sync."""
+    synctrigger.request('SyncNow API call')
+    logger.log('api_calls: SyncNow requested')
+
 @export_to_docbook(roles=['nm-controller', 'self'],
                     accepts=[Parameter(str, 'A sliver/slice name.')],
                    returns=Parameter(int, '1 if successful'))
@@ -227,7 +244,7 @@ def ReCreate(sliver_name):
 @export_to_docbook(roles=['nm-controller', 'self'],
                     accepts=[Parameter(str, 'A sliver/slice name.')],
                    returns=Parameter(dict, "A resource specification"))
-@export_to_api(1)
+@export_to_api(1, readonly=True)
 def GetEffectiveRSpec(sliver_name):
     """Return the RSpec allocated to the specified sliver, including loans"""
     rec = sliver_name
@@ -237,7 +254,7 @@ def GetEffectiveRSpec(sliver_name):
 @export_to_docbook(roles=['nm-controller', 'self'],
                     accepts=[Parameter(str, 'A sliver/slice name.')],
                     returns={"resource name" : Parameter(int, "amount")})
-@export_to_api(1)
+@export_to_api(1, readonly=True)
 def GetRSpec(sliver_name):
     """Return the RSpec allocated to the specified sliver, excluding loans"""
     rec = sliver_name
@@ -250,7 +267,7 @@ def GetRSpec(sliver_name):
                              Parameter(str, 'resource name'),
                              Parameter(int, 'resource amount'))])
 
-@export_to_api(1)
+@export_to_api(1, readonly=True)
 def GetLoans(sliver_name):
     """Return the list of loans made by the specified sliver"""
     rec = sliver_name
@@ -283,11 +300,13 @@ def SetLoans(sliver_name, loans):
     if not validate_loans(loans):
         raise xmlrpclib.Fault(102, 'Invalid argument: the second argument must be a well-formed loan specification')
     rec['_loans'] = loans
+    # even if the effective rspecs do not change, the loans show in the snapshot
+    database.db.mark_dirty(rec['name'])
     database.db.sync()
 
 @export_to_docbook(roles=['nm-controller', 'self'],
                    returns=Parameter(dict, 'Record dictionary'))
-@export_to_api(0)
+@export_to_api(0, readonly=True)
 def GetRecord(sliver_name):
     """Return sliver record"""
     rec = sliver_name
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+#
+# Benchmark the node manager against synthetic nodes
+#
+
+"""Benchmark the node manager module chain against synthetic nodes.
+
+For each requested number of slivers, a fresh python process sets up a
+fake node in a scratch directory (see fakenode.py), generates a
+GetSlivers payload (see synthetic.py), and runs NodeManager.GetSlivers
+and all the modules a few times, as the main loop would.  The first
+cycle is where slivers get created; the following ones show the
+steady state.  The results are printed as a table:
+
+ * first and steady: the time spent in each module in the first cycle,
+   and on average in the following ones, in seconds
+ * rss: the largest increase of the resident set size across one call
+   of the module, in KiB
+
+bwmon does its work in its own thread, triggered by slivermanager; it
+is reported as bwmon.sync.  Likewise, the slivers get created and
+configured by the accounts worker pool; the time it takes to complete
+once slivermanager has returned is reported as accounts.
+
+This never touches the node it runs on, but since it is meant to run
+on a development box, it refuses to run on what looks like a node.
+
+  python bench/bench.py --slivers 10,100 --cycles 5
+
+With --trace, the GetSlivers payloads and other PLC answers come from
+a trace recorded on a real node with nodemanager.py --record, instead
+of being generated; they are replayed as fast as possible.
+
+  python bench/bench.py --trace node1.trace --cycles 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+import cPickle
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.dirname(BENCH_DIR)
+
+DEFAULT_SLIVERS = "10,100,1000,5000"
+
+def parse_options():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-s', '--slivers', action='store', dest='slivers', default=DEFAULT_SLIVERS,
+                      help='comma-separated numbers of slivers -- default %s' % DEFAULT_SLIVERS)
+    parser.add_option('-t', '--tags', action='store', type='int', dest='tags', default=10,
+                      help='tags per sliver -- default 10')
+    parser.add_option('-k', '--keys', action='store', type='int', dest='keys', default=3,
+                      help='ssh keys per sliver -- default 3')
+    parser.add_option('-c', '--cycles', action='store', type='int', dest='cycles', default=3,
+                      help='number of cycles, including the first one -- default 3')
+    parser.add_option('--churn', action='store', type='int', dest='churn', default=0,
+                      help='percentage of slivers that get new keys at each cycle -- default 0')
+    parser.add_option('--leases', action='store', type='int', dest='leases', default=0,
+                      help='number of leases; if not 0, the node is reservable -- default 0')
+    parser.add_option('--trace', action='store', dest='trace', default=None,
+                      help='replay the PLC calls from this trace, recorded with nodemanager.py --record')
+    parser.add_option('-m', '--module', action='append', dest='modules', default=[],
+                      help='only run this module (can be repeated)')
+    parser.add_option('--scratch', action='store', dest='scratch', default=None,
+                      help='where to create the fake nodes -- default a temporary directory')
+    parser.add_option('--keep', action='store_true', dest='keep', default=False,
+                      help='keep the fake nodes for inspection')
+    parser.add_option('--force', action='store_true', dest='force', default=False,
+                      help='run even if this looks like a node')
+    # internal: run one size in this process and pickle the results in that file
+    parser.add_option('--run-one', action='store', dest='run_one', default=None, help=optparse.SUPPRESS_HELP)
+    (options, args) = parser.parse_args()
+    if args:
+        parser.print_help()
+        sys.exit(1)
+    return options
+
+####################
+def rss():
+    """The current resident set size of this process, in KiB"""
+    import fakenode
+    f = fakenode.real['open']('/proc/self/statm')
+    try: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+    finally: f.close()
+
+def run_one(slivers, root, options):
+    """Benchmark one node with <slivers> slivers; runs in its own process"""
+    sys.path.insert(0, os.path.join(BENCH_DIR, 'standins'))
+    sys.path.insert(1, SOURCE_DIR)
+    import fakenode
+    sources = [SOURCE_DIR, BENCH_DIR]
+    if options.trace: sources.append(options.trace)
+    fakenode.install(root, sources)
+    import synthetic
+    fakenode.populate(SOURCE_DIR, synthetic.NODE_ID, synthetic.VREFS, synthetic.VSYS_SCRIPTS)
+
+    import logger
+    fakenode.replace_logger_commands(logger)
+    import curlwrapper
+    curlwrapper.retrieve = lambda url, *args, **kwds: "# %s\n" % url
+    # the API servers are not on the sync path, and would bind real sockets
+    import api
+    api.start = lambda: None
+    import tools
+    import cyclestats
+    import bwmon
+    import accounts
+    from config import Config
+
+    # importing nodemanager starts it in a thread, for debugging purposes - not here
+    as_daemon_thread = tools.as_daemon_thread
+    tools.as_daemon_thread = lambda run: None
+    try: import nodemanager
+    finally: tools.as_daemon_thread = as_daemon_thread
+
+    plugins = os.path.join(SOURCE_DIR, 'plugins')
+    sys.argv = [ 'nodemanager.py', '-P', plugins ]
+    nm = nodemanager.NodeManager()
+    if options.modules:
+        nm.modules = options.modules
+    nm.load_modules()
+
+    # measure the memory taken by each module
+    rss_growth = {}
+    def measured(name, callback):
+        def wrapper(*args, **kwds):
+            before = rss()
+            try: return callback(*args, **kwds)
+            finally: rss_growth[name] = max(rss_growth.get(name, 0), rss() - before)
+        return wrapper
+    for module in nm.loaded_modules:
+        module.GetSlivers = measured(module.__name__, module.GetSlivers)
+    def timed(callback):
+        def wrapper(*args):
+            timer = cyclestats.start('bwmon.sync')
+            try: return callback(*args)
+            finally: timer.stop()
+        return wrapper
+    bwmon.sync = timed(bwmon.sync)
+
+    cycles = options.cycles
+    if options.trace:
+        import plctrace
+        player = plctrace.Player(options.trace, fast=True)
+        plc = plctrace.ReplayingPLCAPI(player, 'https://replay/PLCAPI/', None, None)
+        cycles = min(cycles, player.remaining('GetSlivers'))
+        if cycles:
+            slivers = len(player.pending['GetSlivers'][0][5].get('slivers', []))
+    else:
+        data = synthetic.payload(slivers, options.tags, options.keys, leases=options.leases)
+        plc = synthetic.PLC(data, options.churn)
+    config = Config()
+    # without it, nothing clears bwmon.lock
+    bwmon_running = 'bwmon' in [ m.__name__ for m in nm.loaded_modules ]
+    rss_start = rss()
+    for cycle in range(cycles):
+        nm.GetSlivers(config, plc)
+        # the slivers get created, started and configured in the background
+        timer = cyclestats.start('accounts')
+        accounts.wait()
+        timer.stop()
+        # let bwmon catch up, it would otherwise overlap with the next cycle
+        while bwmon_running and bwmon.lock.isSet(): time.sleep(0.05)
+
+    results = { 'slivers': slivers,
+                'modules': [ (m.__name__, getattr(m, 'priority', nodemanager.NodeManager.default_priority))
+                             for m in nm.loaded_modules ],
+                'timers': {},
+                'rss_growth': rss_growth,
+                'rss_start': rss_start,
+                'rss_end': rss(),
+                'commands': fakenode.commands,
+                'values': cyclestats.values.copy(),
+                }
+    for (name, histogram) in cyclestats.timers.items():
+        results['timers'][name] = histogram.samples[:]
+    return results
+
+####################
+def first_and_steady(samples):
+    if not samples: return (None, None)
+    if len(samples) == 1: return (samples[0], None)
+    return (samples[0], sum(samples[1:]) / len(samples[1:]))
+
+def seconds(value):
+    if value is None: return '-'
+    return '%.3f' % value
+
+def report(results, options):
+    print "==================== %d slivers, %d tags and %d keys each, %d cycles" % \
+        (results['slivers'], options.tags, options.keys, options.cycles)
+    print "%-24s %8s %10s %10s %10s" % ('module', 'priority', 'first', 'steady', 'rss')
+    timers = results['timers']
+    for (name, priority) in results['modules']:
+        (first, steady) = first_and_steady(timers.get('module.%s' % name, []))
+        print "%-24s %8d %10s %10s %10d" % (name, priority, seconds(first), seconds(steady),
+                                             results['rss_growth'].get(name, 0))
+    for name in ('accounts', 'bwmon.sync', 'plc.GetSlivers', 'dumpSlivers', 'changeset', 'sliversview', 'cycle'):
+        (first, steady) = first_and_steady(timers.get(name, []))
+        print "%-24s %8s %10s %10s" % (name, '', seconds(first), seconds(steady))
+    values = results['values']
+    print "GetSlivers dumps: %d written, %d skipped as unchanged" % \
+        (values.get('dumpSlivers.writes', 0), values.get('dumpSlivers.skipped', 0))
+    print "rss: %d KiB after startup, %d KiB at the end" % (results['rss_start'], results['rss_end'])
+    commands = results['commands'].items()
+    commands.sort()
+    print "commands: %s" % ", ".join(["%s x%d" % command for command in commands])
+
+def main():
+    options = parse_options()
+    if options.run_one:
+        (slivers, root, output) = options.run_one.split(':')
+        results = run_one(int(slivers), root, options)
+        f = open(output, 'w')
+        try: cPickle.dump(results, f)
+        finally: f.close()
+        # daemon threads (bwmon, the dumpers) are still around
+        os._exit(0)
+
+    sys.path.insert(0, BENCH_DIR)
+    import fakenode
+    node = fakenode.looks_like_a_node()
+    if node and not options.force:
+        print "%s exists, this looks like a node -- not running the benchmark (see --force)" % node
+        sys.exit(1)
+
+    scratch = options.scratch or tempfile.mkdtemp(prefix='nm-bench-')
+    try:
+        if options.trace:
+            # the number of slivers is whatever was recorded
+            options.trace = os.path.abspath(options.trace)
+            sizes = [ 0 ]
+        else:
+            sizes = [ int(n) for n in options.slivers.split(',') ]
+        for slivers in sizes:
+            root = os.path.join(scratch, 'node-%d' % slivers)
+            output = os.path.join(scratch, 'results-%d.pickle' % slivers)
+            os.makedirs(root)
+            command = [ sys.executable, os.path.abspath(__file__), '--run-one', '%d:%s:%s' % (slivers, root, output) ]
+            for option in sys.argv[1:]: command.append(option)
+            if options.trace: command += [ '--trace', options.trace ]
+            if subprocess.call(command) != 0 or not os.path.exists(output):
+                print "benchmark with %d slivers failed, see %s/var/log/nodemanager" % (slivers, root)
+                continue
+            f = open(output)
+            try: report(cPickle.load(f), options)
+            finally: f.close()
+    finally:
+        if options.keep: print "fake nodes left in %s" % scratch
+        else: shutil.rmtree(scratch, True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""A fake PlanetLab node in a scratch directory, for the benchmark.
+
+install(root) must be called before any node manager module is
+imported.  From then on, in this process:
+ * absolute paths under REDIRECTED (/etc, /var, /vservers, /dev/cgroup...)
+   are looked up under <root> instead, by all the file-related functions
+   of the os module, and by the open, file and execfile builtins;
+ * the passwd and group databases are replaced with an in-memory table,
+   that the vuseradd, vuserdel and usermod stand-ins change, and
+   that is written to <root>/etc/passwd and <root>/etc/group after each
+   change, for pwdcache to notice;
+ * external commands (logger.log_call, os.system, os.popen, subprocess)
+   are not run, and just get recorded in <commands>.
+
+This is only meant to keep the benchmark off the real node, not to
+sandbox anything: paths outside REDIRECTED are left alone.
+"""
+
+import os
+import pwd
+import grp
+import errno
+import shutil
+import __builtin__
+import subprocess
+import StringIO
+
+REDIRECTED = ('/etc', '/var', '/root', '/home', '/vservers', '/vsys',
+              '/dev/cgroup', '/dev/mapper', '/sys', '/proc', '/usr/boot', '/usr/share/NodeManager')
+
+# set by install()
+root = None
+# paths that are never redirected, e.g. the node manager sources when they are in /root
+passthrough = []
+# command -> number of times it was run
+commands = {}
+
+# the original functions, for the benchmark's own use
+real = {}
+
+def rewrite(path):
+    if not isinstance(path, basestring) or not path.startswith('/'): return path
+    for exempt in [root] + passthrough:
+        if path == exempt or path.startswith(exempt + '/'): return path
+    for prefix in REDIRECTED:
+        if path == prefix or path.startswith(prefix + '/'):
+            return root + path
+    return path
+
+####################
+def redirect_first(function):
+    def redirected(path, *args, **kwds):
+        return function(rewrite(path), *args, **kwds)
+    redirected.__name__ = function.__name__
+    return redirected
+
+def redirect_both(function):
+    def redirected(src, dst, *args, **kwds):
+        return function(rewrite(src), rewrite(dst), *args, **kwds)
+    redirected.__name__ = function.__name__
+    return redirected
+
+def ignore_eperm(function):
+    # ownership changes fail when not running as root, that does not matter here
+    def tolerant(*args):
+        try: return function(*args)
+        except OSError, e:
+            if e.errno != errno.EPERM: raise
+    tolerant.__name__ = function.__name__
+    return tolerant
+
+real_file = file
+class RedirectedFile(real_file):
+    def __init__(self, name, *args):
+        real_file.__init__(self, rewrite(name), *args)
+
+OS_FIRST = ('open', 'stat', 'lstat', 'listdir', 'mkdir', 'rmdir', 'unlink', 'remove',
+            'chmod', 'readlink', 'mknod', 'access', 'utime', 'statvfs')
+OS_BOTH = ('rename', 'link', 'symlink')
+
+def redirect_files():
+    for name in OS_FIRST:
+        real['os.' + name] = getattr(os, name)
+        setattr(os, name, redirect_first(getattr(os, name)))
+    for name in OS_BOTH:
+        real['os.' + name] = getattr(os, name)
+        setattr(os, name, redirect_both(getattr(os, name)))
+    for name in ('chown', 'lchown'):
+        real['os.' + name] = getattr(os, name)
+        setattr(os, name, ignore_eperm(redirect_first(getattr(os, name))))
+    for name in ('open', 'file', 'execfile'):
+        real[name] = getattr(__builtin__, name)
+    __builtin__.open = redirect_first(real['open'])
+    __builtin__.file = RedirectedFile
+    __builtin__.execfile = redirect_first(real['execfile'])
+
+####################
+# the passwd and group databases
+SLICES_GID = 2000
+passwd = {}
+groups = {}
+
+def add_account(name, uid, gid, home, shell):
+    passwd[name] = pwd.struct_passwd((name, 'x', uid, gid, name, home, shell))
+    save_accounts()
+
+def save_accounts():
+    write('/etc/passwd', "".join([ "%s\n" % ":".join([str(field) for field in pw_ent])
+                                   for pw_ent in passwd.values() ]))
+    write('/etc/group', "".join([ "%s:%s:%d:%s\n" % (gr_ent[0], gr_ent[1], gr_ent[2], ",".join(gr_ent[3]))
+                                  for gr_ent in groups.values() ]))
+
+def getpwnam(name):
+    try: return passwd[name]
+    except KeyError: raise KeyError, "getpwnam(): name not found: %s" % name
+
+def getpwuid(uid):
+    for pw_ent in passwd.values():
+        if pw_ent[2] == uid: return pw_ent
+    raise KeyError, "getpwuid(): uid not found: %d" % uid
+
+def getpwall():
+    return passwd.values()
+
+def getgrnam(name):
+    try: return groups[name]
+    except KeyError: raise KeyError, "getgrnam(): name not found: %s" % name
+
+def getgrall():
+    return groups.values()
+
+def replace_accounts():
+    groups['root'] = grp.struct_group(('root', 'x', 0, []))
+    groups['slices'] = grp.struct_group(('slices', 'x', SLICES_GID, []))
+    add_account('root', 0, 0, '/root', '/bin/bash')
+    add_account('site_admin', 502, 502, '/home/site_admin', '/bin/bash')
+    pwd.getpwnam = getpwnam
+    pwd.getpwuid = getpwuid
+    pwd.getpwall = getpwall
+    grp.getgrnam = getgrnam
+    grp.getgrall = getgrall
+
+####################
+# external commands
+next_uid = [10000]
+
+def vuseradd(args):
+    name = args[-1]
+    if name in passwd: return
+    vref = args[args.index('-t') + 1]
+    add_account(name, next_uid[0], SLICES_GID, '/home/%s' % name, '/bin/vsh')
+    next_uid[0] += 1
+    for path in ('/home/%s' % name,
+                 '/vservers/%s/etc/rc.d/init.d' % name, '/vservers/%s/etc/rc.d/rc3.d' % name,
+                 '/vservers/%s/home/%s' % (name, name), '/etc/vservers/%s' % name):
+        os.makedirs(path)
+
+def vuserdel(args):
+    name = args[-1]
+    if name not in passwd: return
+    del passwd[name]
+    save_accounts()
+    for path in ('/home/%s' % name, '/vservers/%s' % name, '/etc/vservers/%s' % name, '/dev/cgroup/%s' % name):
+        shutil.rmtree(rewrite(path), True)
+
+def usermod(args):
+    # only renaming, as done by sliverpool: usermod -l new -d /home/new -m old
+    (old, new) = (args[-1], args[args.index('-l') + 1])
+    if old not in passwd: return
+    pw_ent = passwd.pop(old)
+    add_account(new, pw_ent[2], pw_ent[3], '/home/%s' % new, pw_ent[6])
+    os.rename('/home/%s' % old, '/home/%s' % new)
+
+STANDINS = { 'vuseradd': vuseradd, 'vuserdel': vuserdel, 'usermod': usermod }
+
+def run_command(command):
+    """Record <command> - either a list or a shell command line - and return its output"""
+    if isinstance(command, basestring): args = command.split()
+    else: args = list(command)
+    # skip wrappers like '/bin/bash -x' or '/bin/nice -n 19'
+    while args and os.path.basename(args[0]) in ('bash', 'sh', 'nice', 'ionice'):
+        args = args[1:]
+        while args and (args[0].startswith('-') or args[0].isdigit()): args = args[1:]
+    if not args: return ''
+    name = os.path.basename(args[0])
+    commands[name] = commands.get(name, 0) + 1
+    if name in STANDINS: STANDINS[name](args)
+    if name == 'uname': return os.uname()[4] + '\n'
+    return ''
+
+def log_call(command, timeout = None, poll = 1):
+    run_command(command)
+    return True
+
+def system(command):
+    run_command(command)
+    return 0
+
+def popen(command, mode = 'r', *args):
+    return StringIO.StringIO(run_command(command))
+
+def call(command, *args, **kwds):
+    run_command(command)
+    return 0
+
+class Popen:
+    def __init__(self, command, stdin = None, stdout = None, stderr = None, **kwds):
+        output = run_command(command)
+        self.pid = 0
+        self.returncode = 0
+        self.stdin = StringIO.StringIO()
+        self.stdout = StringIO.StringIO(output)
+        self.stderr = StringIO.StringIO()
+    def communicate(self, input = None):
+        return (self.stdout.read(), '')
+    def poll(self):
+        return self.returncode
+    def wait(self):
+        return self.returncode
+    def kill(self, *args): pass
+
+def replace_commands():
+    os.system = system
+    os.popen = popen
+    subprocess.call = call
+    subprocess.Popen = Popen
+
+def replace_logger_commands(logger):
+    logger.log_call = log_call
+
+####################
+def write(path, contents):
+    path = rewrite(path)
+    if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+    f = real['open'](path, 'w')
+    try: f.write(contents)
+    finally: f.close()
+
+PLC_CONFIG = """PLC_API_HOST = 'plc.bench.example.org'
+PLC_API_PORT = 80
+PLC_API_PATH = 'PLCAPI'
+PLC_BOOT_HOST = 'boot.bench.example.org'
+PLC_SLICE_PREFIX = 'pl'
+"""
+
+def populate(source_dir, node_id, vrefs, vsys_scripts, cpus = 4):
+    """Create the files and directories that the modules expect on a node"""
+    for path in ('/var/lib/nodemanager', '/var/log', '/var/run', '/root', '/home/site_admin',
+                 '/vsys', '/etc/vservers/.defaults/cgroup', '/etc/codemux', '/etc/init.d',
+                 '/sys/block', '/dev/cgroup', '/usr/boot'):
+        os.makedirs(rewrite(path))
+    for vref in vrefs: os.makedirs(rewrite('/vservers/.vref/%s' % vref))
+    write('/etc/planetlab/plc_config', PLC_CONFIG)
+    write('/etc/planetlab/node_id', '%d\n' % node_id)
+    write('/etc/planetlab/session', 'bench-session\n')
+    write('/usr/boot/plnode.txt', 'NET_DEVICE="00:16:3e:00:00:01"\n')
+    write('/proc/partitions', 'major minor  #blocks  name\n\n')
+    write('/proc/mounts', 'rootfs / rootfs rw 0 0\n')
+    for script in vsys_scripts: write('/vsys/%s' % script, '#!/bin/sh\n')
+    vinit = real['open'](os.path.join(source_dir, 'sliver-initscripts', 'vinit')).read()
+    write('/usr/share/NodeManager/sliver-initscripts/vinit', vinit)
+    # cpu topology, for coresched
+    cpulist = "0-%d" % (cpus - 1)
+    write('/dev/cgroup/cpuset.cpus', cpulist + '\n')
+    write('/dev/cgroup/cpuset.mems', '0\n')
+    write('/sys/devices/system/node/node0/cpulist', cpulist + '\n')
+    for cpu in range(cpus):
+        write('/sys/devices/system/cpu/cpu%d/topology/core_siblings' % cpu, '%x\n' % (2 ** cpus - 1))
+
+def looks_like_a_node():
+    """Whether we are running on what seems to be an actual node"""
+    for path in ('/etc/planetlab/node_id', '/vservers', '/var/lib/nodemanager'):
+        if os.path.exists(path): return path
+    return None
+
+def install(scratch, sources):
+    """Redirect the node to directory <scratch>; <sources> are left alone"""
+    global root
+    root = os.path.abspath(scratch)
+    passthrough.extend([os.path.abspath(source) for source in sources])
+    assert root != '/'
+    redirect_files()
+    replace_accounts()
+    replace_commands()
@@ -0,0 +1,65 @@
+"""Stand-in for the bwlimit module from util-vserver-pl, for the benchmark.
+
+Instead of driving tc, the HTB classes are kept in a dictionary.
+"""
+
+import pwd
+
+bwmin = 8
+bwmax = 1000*1000*1000
+
+default_xid = 0xfff
+
+# dev -> node cap
+caps = {}
+# xid -> (share, minrate, maxrate, minexemptrate, maxexemptrate, usedbytes, usedi2bytes)
+classes = {}
+
+def get_xid(slice):
+    if slice == "root": return 0
+    if slice == "default": return default_xid
+    try: return pwd.getpwnam(slice)[2]
+    except KeyError: return 0x1000 + hash(slice) % 0x10000
+
+def get_slice(xid):
+    if xid == 0: return "root"
+    if xid == default_xid: return "default"
+    try: return pwd.getpwuid(xid)[0]
+    except KeyError: return None
+
+def format_tc_rate(rate):
+    if rate >= 1000000: return "%.0fmbit" % (rate / 1000000.)
+    if rate >= 1000: return "%.0fkbit" % (rate / 1000.)
+    return "%.0fbit" % rate
+
+def get_bwcap(dev = "eth0"):
+    return caps.get(dev, bwmax)
+
+def init(dev, bwcap):
+    caps[dev] = bwcap
+
+def stop(dev = "eth0"):
+    classes.clear()
+
+def tc(cmd):
+    if cmd.startswith("class show"):
+        return ["class htb 1:1 root"] + ["class htb 1:%x parent 1:1" % xid for xid in classes]
+    return []
+
+def exempt_init(group_name, node_ips):
+    pass
+
+def get(xid = None, dev = "eth0"):
+    result = []
+    for (x, params) in classes.items():
+        if xid is None or x == xid: result.append((x,) + params)
+    return result
+
+def set(xid, share = 1, minrate = None, maxrate = None, minexemptrate = None, maxexemptrate = None, dev = "eth0"):
+    (usedbytes, usedi2bytes) = (0, 0)
+    if xid in classes: (usedbytes, usedi2bytes) = classes[xid][-2:]
+    classes[xid] = (share, minrate or bwmin, maxrate or bwmax, minexemptrate or bwmin, maxexemptrate or bwmax,
+                    usedbytes, usedi2bytes)
+
+def off(xid, dev = "eth0"):
+    if xid in classes: del classes[xid]
@@ -0,0 +1,4 @@
+"""Stand-in for the plnet module from util-vserver-pl, for the benchmark."""
+
+def InitInterfaces(logger, plc, data):
+    logger.verbose("plnet: (stand-in) InitInterfaces on %d interface(s)" % len(data.get('interfaces', [])))
@@ -0,0 +1,15 @@
+"""Stand-in for the sioc module from util-vserver-pl, for the benchmark.
+
+The fake node has a single interface, that the synthetic GetSlivers
+payloads in fakenode.py refer to.
+"""
+
+devices = { 'eth0': ('10.0.0.1', '00:16:3e:00:00:01') }
+
+def gifconf():
+    result = {}
+    for (dev, (ip, mac)) in devices.items(): result[dev] = ip
+    return result
+
+def gifhwaddr(dev):
+    return devices[dev][1]
@@ -0,0 +1,97 @@
+"""Stand-in for the vserver module from util-vserver-pl, for the benchmark.
+
+A vserver exists when its configuration directory /etc/vservers/<name>
+exists (as created by the vuseradd stand-in in fakenode.py), and is
+running when the 'run' file in there exists.  Everything goes through
+the file system, so that it works from the children that sliver_vs.py
+forks to start slivers.
+"""
+
+import os
+
+VC_LIM_KEEP = -2
+
+RLIMITS = { "NSOCK": 11,
+            "OPENFD": 7,
+            "ANON": 10,
+            "SHMEM": 12,
+            }
+
+class NoSuchVServer(Exception): pass
+
+class VServer:
+
+    def __init__(self, name, vm_id = None, vm_running = None, logfile = None):
+        self.name = name
+        self.dir = "/vservers/%s" % name
+        self.config_dir = "/etc/vservers/%s" % name
+        if not os.path.isdir(self.config_dir):
+            raise NoSuchVServer, "%s: no such vserver" % name
+        self.vm_running = vm_running
+        self.disk_blocks = 0
+        self.rlimits = {}
+
+    def run_file(self):
+        return os.path.join(self.config_dir, 'run')
+
+    def start(self, *args):
+        f = open(self.run_file(), 'w')
+        f.close()
+        cgroup = "/dev/cgroup/%s" % self.name
+        if not os.path.isdir(cgroup): os.mkdir(cgroup)
+
+    def stop(self, *args):
+        try: os.unlink(self.run_file())
+        except OSError: pass
+
+    def is_running(self):
+        return os.path.exists(self.run_file())
+
+    def init_disk_info(self):
+        self.disk_blocks = 0
+        self.disk_inodes = 0
+        for (root, dirs, files) in os.walk(self.dir):
+            self.disk_blocks += len(files)
+            self.disk_inodes += len(dirs) + len(files)
+        return self.disk_blocks
+
+    # the kernel's disk limit and usage counters, as 'blocks limit inodes'
+    def dlimit_file(self):
+        return os.path.join(self.config_dir, 'dlimit')
+
+    def get_disklimit(self):
+        try: f = open(self.dlimit_file())
+        except IOError: return -1
+        try: (self.disk_blocks, block_limit, self.disk_inodes) = [ int(x) for x in f.read().split() ]
+        finally: f.close()
+        return block_limit
+
+    def set_disklimit(self, block_limit):
+        if self.vm_running:
+            # like DLIMIT_KEEP, the counters are left alone
+            try:
+                f = open(self.dlimit_file())
+                try: (blocks, previous_limit, inodes) = [ int(x) for x in f.read().split() ]
+                finally: f.close()
+            except IOError: (blocks, inodes) = (0, 0)
+        else:
+            # like util-vserver, init_disk_info() must have been called
+            (blocks, inodes) = (self.disk_blocks, self.disk_inodes)
+        f = open(self.dlimit_file(), 'w')
+        try: f.write("%d %d %d\n" % (blocks, block_limit, inodes))
+        finally: f.close()
+        self.disk_limit = block_limit
+
+    def set_rlimit(self, type, hard, soft, minimum):
+        if self.rlimits.get(type) == (hard, soft, minimum): return False
+        self.rlimits[type] = (hard, soft, minimum)
+        return True
+
+    def set_capabilities_config(self, capabilities):
+        self.capabilities = capabilities
+
+    def set_sched_config(self, cpu_min, cpu_share):
+        self.sched = (cpu_min, cpu_share)
+
+    def set_ipaddresses_config(self, addresses, add_loopback = True):
+        self.ipaddresses = (addresses, add_loopback)
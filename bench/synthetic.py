@@ -0,0 +1,135 @@
+"""Synthetic GetSlivers payloads, and a stand-in for PLCAPI that serves them.
+
+The payloads have the same structure as what PLC returns: slivers
+with their keys and tags, special accounts, conf_files, initscripts,
+interfaces and leases.  They are generated from a seed, so that runs
+are comparable.
+"""
+
+import time
+import random
+import cPickle
+
+NODE_ID = 1
+VREFS = ['planetlab-f12-i386', 'planetlab-f12-x86_64']
+VSYS_SCRIPTS = ['vnet', 'fd_tuntap', 'pfmount', 'vif_up']
+
+# tags that the modules act upon, with a function that returns a value
+def _vsys(rand): return rand.choice(VSYS_SCRIPTS)
+def _vsys_priv(rand): return '10.%d.%d.0/24' % (rand.randrange(256), rand.randrange(256))
+def _codemux(rand): return 'host%d.example.org,%d' % (rand.randrange(1000), rand.randrange(10000, 20000))
+def _disk_max(rand): return str(rand.choice([5, 10, 20]) * 1000 * 1000)
+def _cpu_share(rand): return str(rand.choice([1, 2, 4, 32]))
+def _net_max_rate(rand): return str(rand.choice([1000, 10000, 100000]))
+def _sysctl(rand): return str(rand.choice([131072, 262144]))
+def _one(rand): return '1'
+
+MEANINGFUL_TAGS = [ ('vsys', _vsys),
+                    ('vsys_vnet', _vsys_priv),
+                    ('codemux', _codemux),
+                    ('disk_max', _disk_max),
+                    ('cpu_share', _cpu_share),
+                    ('net_max_rate', _net_max_rate),
+                    ('sysctl.net.core.rmem_max', _sysctl),
+                    ('enable_hmac', _one),
+                    ('rawdisk', _one),
+                    ]
+
+def key(rand, owner):
+    return 'ssh-rsa %s %s@example.org' % (''.join([rand.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')
+                                                   for i in range(372)]), owner)
+
+def sliver(rand, index, tags, keys):
+    name = 'pl_bench%05d' % index
+    attributes = []
+    for (tagname, value) in rand.sample(MEANINGFUL_TAGS, min(tags, len(MEANINGFUL_TAGS))):
+        attributes.append({'tagname': tagname, 'value': value(rand)})
+    for i in range(tags - len(attributes)):
+        attributes.append({'tagname': 'bench_tag%d' % i, 'value': str(rand.randrange(1000000))})
+    return {'name': name,
+            'slice_id': 1000 + index,
+            'instantiation': 'plc-instantiated',
+            'expires': int(time.time()) + 30 * 24 * 3600,
+            'GetSliceFamily': rand.choice(VREFS),
+            'keys': [ {'key_type': 'ssh', 'key': key(rand, '%s-user%d' % (name, i))} for i in range(keys) ],
+            'attributes': attributes,
+            }
+
+def conf_file(index):
+    return {'enabled': True,
+            'source': 'PlanetLabConf/bench%d.conf' % index,
+            'dest': '/etc/bench/bench%d.conf' % index,
+            'file_permissions': '644', 'file_owner': 'root', 'file_group': 'root',
+            'preinstall_cmd': '', 'postinstall_cmd': '', 'error_cmd': '',
+            'ignore_cmd_errors': False, 'always_update': False,
+            }
+
+def payload(slivers, tags = 10, keys = 3, conf_files = 20, leases = 0, seed = 0):
+    """Return a GetSlivers payload with <slivers> slivers having <tags> tags and <keys> keys each"""
+    rand = random.Random(seed)
+    data = {'timestamp': int(time.time()),
+            'node_id': NODE_ID,
+            'hostname': 'node1.bench.example.org',
+            'hrn': 'bench.node1',
+            'xmpp': {'server': None, 'user': None, 'password': None},
+            'groups': [],
+            'interfaces': [ {'interface_id': 1, 'hostname': 'node1.bench.example.org', 'is_primary': True,
+                             'ip': '10.0.0.1', 'mac': '00:16:3e:00:00:01', 'bwlimit': None,
+                             'interface_tag_ids': []} ],
+            'conf_files': [ conf_file(i) for i in range(conf_files) ],
+            'initscripts': [ {'name': 'bench_initscript', 'script': '#!/bin/sh\ntrue\n'} ],
+            'accounts': [ {'name': 'root', 'keys': [ key(rand, 'root%d' % i) for i in range(keys) ]},
+                          {'name': 'site_admin', 'keys': [ key(rand, 'admin%d' % i) for i in range(keys) ]} ],
+            'reservation_policy': 'none',
+            'lease_granularity': 3600,
+            'leases': [],
+            'slivers': [ sliver(rand, i, tags, keys) for i in range(slivers) ],
+            }
+    if leases:
+        data['reservation_policy'] = 'lease_or_idle'
+        now = int(time.time()) / 3600 * 3600
+        for i in range(leases):
+            owner = data['slivers'][i % slivers]['name']
+            data['leases'].append({'name': owner, 't_from': now + i * 3600, 't_until': now + (i + 1) * 3600})
+    return data
+
+def churn(data, percent, seed):
+    """Change the keys of <percent> % of the slivers, as if users had uploaded new ones"""
+    rand = random.Random(seed)
+    for sliver in rand.sample(data['slivers'], len(data['slivers']) * percent / 100):
+        sliver['keys'][0] = {'key_type': 'ssh', 'key': key(rand, sliver['name'] + '-new')}
+
+
+class PLC:
+    """Serves a synthetic payload in place of PLCAPI; other calls return nothing much"""
+
+    def __init__(self, data, churn = 0):
+        self.data = data
+        self.churn = churn
+        self.calls = 0
+        self.timeout = 30
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    def GetSlivers(self):
+        self.calls += 1
+        if self.churn and self.calls > 1:
+            churn(self.data, self.churn, self.calls)
+        # at least a second apart, as between two real cycles
+        self.data['timestamp'] = int(time.time()) + self.calls
+        # the real thing gives a fresh copy each time
+        return cPickle.loads(cPickle.dumps(self.data, cPickle.HIGHEST_PROTOCOL))
+
+    def check_authentication(self):
+        return True
+
+    def GetNodes(self, *args):
+        return [ {'node_id': NODE_ID, 'site_id': 1} ]
+
+    def AddSliceTag(self, *args):
+        return 1
+
+    def __getattr__(self, name):
+        if name.startswith('_'): raise AttributeError, name
+        return lambda *args: []
@@ -20,13 +20,13 @@ import sys
 import time
 import pickle
 import socket
-import copy
 import threading
 
 import logger
 import tools
 import bwlimit
 import database
+import pwdcache
 from config import Config
 
 priority = 20
@@ -43,9 +43,10 @@ DB_FILE = "/var/lib/nodemanager/bwmon.pickle"
 seconds_per_day = 24 * 60 * 60
 bits_per_byte = 8
 
-dev_default = tools.get_default_if()
+# probing the node is left to the bwmon thread, see probe()
+dev_default = None
 # Burst to line rate (or node cap).  Set by NM. in KBit/s
-default_MaxRate = int(bwlimit.get_bwcap(dev_default) / 1000)
+default_MaxRate = None
 default_Maxi2Rate = int(bwlimit.bwmax / 1000)
 # 5.4 Gbyte per day. 5.4 * 1024 k * 1024M * 1024G
 # 5.4 Gbyte per day max allowed transfered per recording period
@@ -437,6 +438,20 @@ class Slice:
             self.notify(new_maxrate, new_maxi2rate, usedbytes, usedi2bytes)
 
 
+def get_xid(name):
+    """Like bwlimit.get_xid, but slices are looked up in pwdcache"""
+    if name not in ("root", "default"):
+        try: return pwdcache.getpwnam(name)[2]
+        except KeyError: pass
+    return bwlimit.get_xid(name)
+
+def get_slice(xid):
+    """Like bwlimit.get_slice, but slices are looked up in pwdcache"""
+    if xid != bwlimit.get_xid("root") and xid != bwlimit.get_xid("default"):
+        try: return pwdcache.getpwuid(xid)[0]
+        except KeyError: pass
+    return bwlimit.get_slice(xid)
+
 def gethtbs(root_xid, default_xid):
     """
     Return dict {xid: {*rates}} of running htbs as reported by tc that have names.
@@ -449,7 +464,7 @@ def gethtbs(root_xid, default_xid):
          minexemptrate, maxexemptrate,
          usedbytes, usedi2bytes) = params
 
-        name = bwlimit.get_slice(xid)
+        name = get_slice(xid)
 
         if (name is None) \
         and (xid != root_xid) \
@@ -529,7 +544,7 @@ def sync(nmdbcopy):
     # Get running slivers that should be on this node (from plc). {xid: name}
     # db keys on name, bwmon keys on xid.  db doesnt have xid either.
     for plcSliver in nmdbcopy.keys():
-        live[bwlimit.get_xid(plcSliver)] = nmdbcopy[plcSliver]
+        live[get_xid(plcSliver)] = nmdbcopy[plcSliver]
 
     logger.verbose("bwmon: Found %s instantiated slices" % live.keys().__len__())
     logger.verbose("bwmon: Found %s slices in dat file" % slices.values().__len__())
@@ -686,20 +701,28 @@ def allOff():
         for htb in kernelhtbs.keys(): bwlimit.off(htb, dev = dev_default)
 
 
+def probe():
+    """
+    Find out the default interface and its bandwidth cap.
+    """
+    global dev_default, default_MaxRate
+    dev_default = tools.get_default_if()
+    default_MaxRate = int(bwlimit.get_bwcap(dev_default) / 1000)
+
 lock = threading.Event()
 def run():
     """
-    When run as a thread, wait for event, lock db, deep copy it, release it,
+    When run as a thread, wait for event, get the latest database snapshot,
     run bwmon.GetSlivers(), then go back to waiting.
     """
     logger.verbose("bwmon: Thread started")
     while True:
         lock.wait()
         logger.verbose("bwmon: Event received.  Running.")
-        database.db_lock.acquire()
-        nmdbcopy = copy.deepcopy(database.db)
-        database.db_lock.release()
+        # published by database.sync, and never modified: no need to lock or copy it
+        nmdbcopy = database.snapshot()
         try:
+            if dev_default is None: probe()
             if getDefaults(nmdbcopy) and len(bwlimit.tc("class show dev %s" % dev_default)) > 0:
                 # class show to check if net:InitNodeLimit:bwlimit.init has run.
                 sync(nmdbcopy)
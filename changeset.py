@@ -0,0 +1,140 @@
+"""Differences between two successive GetSlivers() payloads.
+
+Most of the time, the data returned by GetSlivers() is exactly the
+same as in the previous cycle; yet every module used to rescan every
+sliver and every attribute in it.  A Snapshot captures an immutable
+image of a payload, and a Changeset compares two snapshots, per sliver,
+per tag, and for the other top-level keys (conf_files, accounts,
+interfaces, and so on).
+
+Modules that define 'use_changeset = True' get the Changeset as the
+'changes' keyword argument to their GetSlivers(); a value of None means
+that no comparison is available (first cycle, PLC unreachable, or the
+module failed last time) and that everything should be considered as
+changed.
+"""
+
+import snapshot
+
+def freeze(obj):
+    """Return an immutable, comparable image of <obj>.  Dicts and lists are turned into tuples,
+with dict items sorted so that the result does not depend on insertion order."""
+    if isinstance(obj, dict):
+        items = [(key, freeze(value)) for (key, value) in obj.iteritems()]
+        items.sort()
+        return tuple(items)
+    if isinstance(obj, (list, tuple)):
+        return tuple([freeze(x) for x in obj])
+    return obj
+
+def checksum(data):
+    """Return a checksum of the contents of GetSlivers payload <data>, leaving out its timestamp.
+Unlike the pickled bytes, this only depends on the values, not on how the dicts were built."""
+    contents = dict([ (key, value) for (key, value) in data.iteritems() if key != 'timestamp' ])
+    return snapshot.checksum(repr(freeze(contents)))
+
+def tagname(attribute):
+    # for legacy, try the old-fashioned 'name' as well
+    return attribute.get('tagname', attribute.get('name', ''))
+
+
+class SliverState:
+    """The part of a sliver that we compare: its plain fields, and its tags as a dict tagname -> values."""
+    def __init__(self, sliver):
+        self.fields = {}
+        self.tags = {}
+        for (key, value) in sliver.iteritems():
+            if key == 'attributes':
+                for attribute in value:
+                    self.tags.setdefault(tagname(attribute), []).append(freeze(attribute['value']))
+            else:
+                self.fields[key] = freeze(value)
+        for (name, values) in self.tags.iteritems():
+            values.sort()
+            self.tags[name] = tuple(values)
+
+    def diff_fields(self, other):
+        """Return the set of field names that differ between self and <other>."""
+        return _diff_dicts(self.fields, other.fields)
+
+    def diff_tags(self, other):
+        """Return the set of tag names that were added, removed or changed between self and <other>."""
+        return _diff_dicts(self.tags, other.tags)
+
+def _diff_dicts(d1, d2):
+    changed = set()
+    for (key, value) in d1.iteritems():
+        if key not in d2 or d2[key] != value: changed.add(key)
+    for key in d2:
+        if key not in d1: changed.add(key)
+    return changed
+
+
+class Snapshot:
+    """An immutable image of a GetSlivers() payload, so that modules can tweak the data
+(e.g. slivermanager adds 'reservation_alive') without spoiling the next comparison."""
+    def __init__(self, data):
+        self.slivers = {}
+        self.globals = {}
+        for (key, value) in data.iteritems():
+            # the timestamp changes on every call, and carries no information
+            if key == 'timestamp': continue
+            if key == 'slivers':
+                for sliver in value: self.slivers[sliver['name']] = SliverState(sliver)
+            else:
+                self.globals[key] = freeze(value)
+
+
+class Changeset:
+    """What changed between two Snapshots.
+
+    added, removed, modified - sets of sliver names
+    modified_tags - dict sliver name -> set of tag names that changed, for modified slivers
+    modified_fields - dict sliver name -> set of plain field names (e.g. 'keys') that changed
+    modified_globals - set of top-level keys (e.g. 'conf_files') that changed
+    """
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        old_names = set(old.slivers.keys())
+        new_names = set(new.slivers.keys())
+        self.added = new_names - old_names
+        self.removed = old_names - new_names
+        self.modified = set()
+        self.modified_tags = {}
+        self.modified_fields = {}
+        for name in old_names & new_names:
+            old_state = old.slivers[name]
+            new_state = new.slivers[name]
+            tags = old_state.diff_tags(new_state)
+            fields = old_state.diff_fields(new_state)
+            if tags or fields:
+                self.modified.add(name)
+                self.modified_tags[name] = tags
+                self.modified_fields[name] = fields
+        self.modified_globals = _diff_dicts(old.globals, new.globals)
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.modified or self.modified_globals)
+
+    def sliver_changed(self, name):
+        return name in self.added or name in self.removed or name in self.modified
+
+    def global_changed(self, key):
+        return key in self.modified_globals
+
+    def tags_changed(self):
+        """Return the set of tag names that changed on any sliver, including
+the tags carried by slivers that were added or removed."""
+        result = set()
+        for name in self.added: result.update(self.new.slivers[name].tags.keys())
+        for name in self.removed: result.update(self.old.slivers[name].tags.keys())
+        for tags in self.modified_tags.itervalues(): result.update(tags)
+        return result
+
+    def tag_changed(self, tagname):
+        return tagname in self.tags_changed()
+
+    def __repr__(self):
+        return "<Changeset added=%d removed=%d modified=%d globals=%s>" % \
+            (len(self.added), len(self.removed), len(self.modified), list(self.modified_globals))
@@ -2,12 +2,10 @@
 """Delegate accounts are used to provide secure access to the XMLRPC API.
 They are normal Unix accounts with a shell that tunnels XMLRPC requests to the API server."""
 
-from pwd import getpwnam
-from grp import getgrnam
-
 import logger
 import tools
 import accounts
+from pwdcache import getpwnam, getgrnam
 
 class Controller(accounts.Account):
     SHELL = '/usr/bin/forward_api_calls'  # tunneling shell
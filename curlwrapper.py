@@ -6,9 +6,11 @@
 # the (broken) pycurl version can be found in tags 2.0-9 and 2.0-10
 
 from subprocess import PIPE, Popen
-from select import select
+from select import select, error as select_error
 import xmlrpclib
 import signal
+import errno
+import time
 import os
 
 import logger
@@ -35,7 +37,16 @@ def retrieve(url, cacert=None, postdata=None, timeout=90):
     p = Sopen(command , stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
     if postdata: p.stdin.write(postdata)
     p.stdin.close()
-    sout, sin, serr = select([p.stdout,p.stderr],[],[], timeout)
+    if timeout: deadline = time.time() + timeout
+    while True:
+        remaining = None
+        if timeout: remaining = max(0, deadline - time.time())
+        try:
+            sout, sin, serr = select([p.stdout,p.stderr],[],[], remaining)
+            break
+        except select_error, e:
+            # e.g. SIGUSR1 asking for a sync: keep waiting for curl
+            if e[0] != errno.EINTR: raise
     if len(sout) == 0 and len(sin) == 0 and len(serr) == 0: 
         logger.verbose("curlwrapper: timed out after %s" % timeout)
         p.kill(signal.SIGKILL) 
@@ -0,0 +1,124 @@
+"""Timing statistics for the node manager main loop.
+
+Each phase of a cycle (the PLC fetch, the local tweaks on the data,
+the dumps, and each module's GetSlivers) is timed, and the last
+WINDOW measurements of each are kept as a rolling histogram.  Counters
+and gauges (overruns, skips, and the like) can be stored along.
+
+After each cycle, everything is written in STATS_FILE, one line per
+entry, in a format that is easy to grep or to feed to awk:
+
+  timer <name> <count> <last> <min> <mean> <p50> <p90> <max> <histogram>
+  value <name> <value>
+
+where times are in seconds, count is the total number of samples since
+startup, the other statistics cover the rolling window, and histogram
+is the comma-separated number of samples in the window that fall
+below each of BUCKETS, the last one counting the remaining samples.
+"""
+
+import time
+import threading
+
+import logger
+import tools
+
+STATS_FILE = '/var/lib/nodemanager/cycle-stats.txt'
+
+# how many samples we keep for each timer
+WINDOW = 100
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.01, 0.1, 1, 10, 60, 300)
+
+class Histogram:
+    """The last <window> samples of a measurement"""
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = []
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        if len(self.samples) > self.window: del self.samples[0]
+        self.count += 1
+
+    def last(self):
+        return self.samples[-1]
+
+    def percentile(self, percent):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered)-1, int(len(ordered)*percent/100))]
+
+    def buckets(self):
+        counts = [0] * (len(BUCKETS)+1)
+        for sample in self.samples:
+            index = 0
+            while index < len(BUCKETS) and sample >= BUCKETS[index]: index += 1
+            counts[index] += 1
+        return counts
+
+    def summary(self):
+        return "%d %.3f %.3f %.3f %.3f %.3f %.3f %s" % \
+            (self.count, self.last(), min(self.samples), sum(self.samples)/len(self.samples),
+             self.percentile(50), self.percentile(90), max(self.samples),
+             ",".join([str(c) for c in self.buckets()]))
+
+# name -> Histogram
+timers = {}
+# name -> value
+values = {}
+# timers are recorded from modules' threads as well
+stats_lock = threading.Lock()
+
+def record(name, seconds):
+    """Add a sample to the timer <name>"""
+    stats_lock.acquire()
+    try:
+        if name not in timers: timers[name] = Histogram()
+        timers[name].add(seconds)
+    finally: stats_lock.release()
+
+def set_value(name, value):
+    stats_lock.acquire()
+    try: values[name] = value
+    finally: stats_lock.release()
+
+def incr(name, amount=1):
+    stats_lock.acquire()
+    try: values[name] = values.get(name, 0) + amount
+    finally: stats_lock.release()
+
+class Timer:
+    """Measure the time elapsed between start() and stop(), and record it under <name>"""
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+    def stop(self):
+        elapsed = time.time() - self.started
+        record(self.name, elapsed)
+        return elapsed
+
+def start(name):
+    return Timer(name)
+
+def format_stats():
+    stats_lock.acquire()
+    try:
+        lines = ["# nodemanager cycle stats - %s\n" % time.asctime(time.gmtime())]
+        names = timers.keys()
+        names.sort()
+        for name in names: lines.append("timer %s %s\n" % (name, timers[name].summary()))
+        names = values.keys()
+        names.sort()
+        for name in names: lines.append("value %s %s\n" % (name, values[name]))
+    finally: stats_lock.release()
+    return "".join(lines)
+
+def write(filename=None):
+    """Dump all stats in <filename>, STATS_FILE by default"""
+    if filename is None: filename = STATS_FILE
+    try:
+        contents = format_stats()
+        tools.write_file(filename, lambda f: f.write(contents))
+    except:
+        logger.log_exc("cyclestats: failed to write %s" % filename)
@@ -10,15 +10,20 @@ computed locally is stored under keys that begin with an underscore,
 and data from PLC is stored under keys that don't.
 
 In order to maintain service when the node reboots during a network
-partition, the database is constantly being dumped to disk.
+partition, the database is constantly being dumped to disk, see Journal.
 """
 
+import os
+import copy
+import heapq
 import cPickle
+import tempfile
 import threading
 import time
 
 import accounts
 import coresched
+import cyclestats
 import logger
 import tools
 import bwmon
@@ -36,6 +41,13 @@ MINIMUM_ALLOCATION = {'cpu_pct': 0,
 LOANABLE_RESOURCES = MINIMUM_ALLOCATION.keys()
 
 DB_FILE = '/var/lib/nodemanager/database.pickle'
+# what changed since DB_FILE was written
+DB_JOURNAL = '/var/lib/nodemanager/database.journal'
+# DB_FILE gets rewritten when the journal grows larger than this, or than DB_FILE itself
+JOURNAL_MIN_SIZE = 1024 * 1024
+
+# sync() normally only handles the records that changed; every so often, it goes through all of them
+AUDIT_PERIOD = 3600
 
 
 # database object and associated lock
@@ -46,6 +58,15 @@ db = None
 db_cond = threading.Condition(db_lock)
 dump_requested = False
 
+# the latest snapshot of the database, published by sync(), for those who only read it
+current = None
+version = 0
+
+def snapshot():
+    """Return the latest published snapshot of the database, or None if there is none yet.
+It is a Database, that must be considered as read-only; it needs no lock."""
+    return current
+
 # decorator that acquires and releases the database lock before and after the decorated operation
 # XXX - replace with "with" statements once we switch to 2.5
 def synchronized(fn):
@@ -58,31 +79,178 @@ def synchronized(fn):
     return sync_fn
 
 
+def public_fields(rec):
+    """The fields of a record that come from PLC, except for the timestamp"""
+    return dict([ (key, value) for (key, value) in rec.iteritems()
+                  if not key.startswith('_') and key != 'timestamp' ])
+
+
 class Database(dict):
+    # when sync() has to go through all records again; 0 means at the next sync
+    _next_audit = 0
+
     def __init__(self):
         self._min_timestamp = 0
+        self._dirty = set()
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild the indexes that let sync() and set_min_timestamp() find
+expired and stale records without looking at all of them:
+ * _expires maps names to expiry times, and _expiry_heap has (expires, name)
+   pairs; entries that no longer match _expires are dropped when they surface;
+ * _timestamps maps names to timestamps, _by_timestamp maps timestamps to
+   sets of names, and _timestamp_heap has the distinct timestamps.
+The same goes for the loan graph, see _update_effective_rspecs().
+The database must be reindexed when loaded from disk."""
+        self._expires = {}
+        self._expiry_heap = []
+        self._timestamps = {}
+        self._by_timestamp = {}
+        self._timestamp_heap = []
+        for name, rec in self.iteritems(): self._index(name, rec)
+        # the loan graph, rebuilt by the next _update_effective_rspecs()
+        self._valid_loans = None
+        self._lenders_to = None
+        self._targets_of = None
+
+    def _index(self, name, rec):
+        """Update the indexes after record <name> was added or changed"""
+        expires = rec.get('expires')
+        if self._expires.get(name) != expires:
+            if expires is None: del self._expires[name]
+            else:
+                self._expires[name] = expires
+                heapq.heappush(self._expiry_heap, (expires, name))
+        timestamp = rec['timestamp']
+        previous = self._timestamps.get(name)
+        if previous != timestamp:
+            if previous is not None: self._by_timestamp[previous].discard(name)
+            self._timestamps[name] = timestamp
+            if timestamp not in self._by_timestamp:
+                self._by_timestamp[timestamp] = set()
+                heapq.heappush(self._timestamp_heap, timestamp)
+            self._by_timestamp[timestamp].add(name)
+
+    def _remove(self, name):
+        """Delete record <name>, and have the next sync() get rid of its sliver"""
+        del self[name]
+        self._expires.pop(name, None)
+        timestamp = self._timestamps.pop(name, None)
+        if timestamp in self._by_timestamp: self._by_timestamp[timestamp].discard(name)
+        self.mark_dirty(name)
+
+    def next_expiry(self):
+        """When the next record expires, or None"""
+        heap = self._expiry_heap
+        while heap and self._expires.get(heap[0][1]) != heap[0][0]: heapq.heappop(heap)
+        if heap: return heap[0][0]
+        return None
+
+    def _dirty_names(self):
+        # databases dumped by older versions do not have it
+        if getattr(self, '_dirty', None) is None: self._dirty = set()
+        return self._dirty
+
+    def mark_dirty(self, name):
+        """Have the next sync() reconcile the sliver <name> with its record, or lack thereof"""
+        self._dirty_names().add(name)
+
+    def _publish(self, changed):
+        """Make a new snapshot of the database available to readers.
+Records not in <changed> are shared with the previous snapshot, so
+only the records that changed get copied; <changed> None means all."""
+        global current, version
+        previous = current
+        snap = Database()
+        snap._min_timestamp = self._min_timestamp
+        for name, rec in self.iteritems():
+            frozen = None
+            if previous is not None:
+                if changed is None:
+                    # e.g. after a full audit: keep sharing the records that did not actually change
+                    frozen = previous.get(name)
+                    if frozen is not None and not equal_but_timestamp(frozen, rec): frozen = None
+                elif name not in changed:
+                    frozen = previous.get(name)
+            if frozen is None:
+                frozen = copy.deepcopy(rec)
+            elif frozen['timestamp'] != rec['timestamp']:
+                # the rest is unchanged, and can still be shared
+                frozen = frozen.copy()
+                frozen['timestamp'] = rec['timestamp']
+            snap[name] = frozen
+        version += 1
+        snap.version = version
+        # readers get either the previous snapshot or this one, never a partial one
+        current = snap
+
+    def request_audit(self):
+        """Have the next sync() go through all records and accounts"""
+        self._next_audit = 0
 
-    def _compute_effective_rspecs(self):
+    def _update_effective_rspecs(self, names=None):
         """Calculate the effects of loans and store the result in field _rspec.
 At the moment, we allow slivers to loan only those resources that they have received directly from PLC.
 In order to do the accounting, we store three different rspecs:
  * field 'rspec', which is the resources given by PLC;
  * field '_rspec', which is the actual amount of resources the sliver has after all loans;
  * and variable resid_rspec, which is the amount of resources the sliver
-   has after giving out loans but not receiving any."""
-        slivers = {}
-        for name, rec in self.iteritems():
-            if 'rspec' in rec:
-                rec['_rspec'] = rec['rspec'].copy()
-                slivers[name] = rec
-        for rec in slivers.itervalues():
-            eff_rspec = rec['_rspec']
+   has after giving out loans but not receiving any.
+Whether a loan is valid only depends on the lender's rspec and loans, and on
+the target being there; so the valid loans are kept in a graph, and only the
+slivers in <names> - whose record changed, appeared or went away - and those
+they lend to or borrow from get recomputed.  <names> None means all of them.
+Return the names of the slivers whose _rspec changed."""
+        if names is None or self._valid_loans is None:
+            # lender -> its valid loans, as (target, resource_name, amount)
+            self._valid_loans = {}
+            # target -> lenders with a loan to it, valid or not
+            self._lenders_to = {}
+            # lender -> targets of its loans, valid or not; the reverse of _lenders_to
+            self._targets_of = {}
+            names = self.keys()
+        lenders = set()
+        affected = set()
+        for name in names:
+            lenders.add(name)
+            # the loans made to it may become valid or invalid
+            lenders.update(self._lenders_to.get(name, ()))
+        for lender in lenders:
+            # forget the loans made so far
+            for target, resource_name, amount in self._valid_loans.pop(lender, ()): affected.add(target)
+            for target in self._targets_of.pop(lender, ()):
+                lenders_to_target = self._lenders_to[target]
+                lenders_to_target.discard(lender)
+                if not lenders_to_target: del self._lenders_to[target]
+            affected.add(lender)
+            rec = self.get(lender)
+            if rec is None or 'rspec' not in rec: continue
             resid_rspec = rec['rspec'].copy()
+            valid = []
             for target, resource_name, amount in rec.get('_loans', []):
-                if target in slivers and amount <= resid_rspec[resource_name] - MINIMUM_ALLOCATION[resource_name]:
-                    eff_rspec[resource_name] -= amount
+                self._lenders_to.setdefault(target, set()).add(lender)
+                self._targets_of.setdefault(lender, set()).add(target)
+                if target in self and 'rspec' in self[target] and \
+                        amount <= resid_rspec[resource_name] - MINIMUM_ALLOCATION[resource_name]:
                     resid_rspec[resource_name] -= amount
-                    slivers[target]['_rspec'][resource_name] += amount
+                    valid.append((target, resource_name, amount))
+                    affected.add(target)
+            self._valid_loans[lender] = valid
+        changed = set()
+        for name in affected:
+            rec = self.get(name)
+            if rec is None or 'rspec' not in rec: continue
+            eff_rspec = rec['rspec'].copy()
+            for target, resource_name, amount in self._valid_loans.get(name, ()):
+                eff_rspec[resource_name] -= amount
+            for lender in self._lenders_to.get(name, ()):
+                for target, resource_name, amount in self._valid_loans.get(lender, ()):
+                    if target == name: eff_rspec[resource_name] += amount
+            if eff_rspec != rec.get('_rspec'):
+                rec['_rspec'] = eff_rspec
+                changed.add(name)
+        return changed
 
     def deliver_record(self, rec):
         """A record is simply a dictionary with 'name' and 'timestamp'
@@ -92,47 +260,84 @@ keys."""
         if rec['timestamp'] < self._min_timestamp: return
         name = rec['name']
         old_rec = self.get(name)
-        if old_rec == None: self[name] = rec
+        if old_rec == None:
+            self[name] = rec
+            self._index(name, rec)
+            self.mark_dirty(name)
         elif rec['timestamp'] > old_rec['timestamp']:
+            # the timestamp changes with every GetSlivers, that alone does not make a difference
+            if public_fields(rec) != public_fields(old_rec): self.mark_dirty(name)
             for key in old_rec.keys():
                 if not key.startswith('_'): del old_rec[key]
             old_rec.update(rec)
+            self._index(name, old_rec)
 
     def set_min_timestamp(self, ts):
         """The ._min_timestamp member is the timestamp on the last comprehensive update.
 We use it to determine if a record is stale.
 This method should be called whenever new GetSlivers() data comes in."""
         self._min_timestamp = ts
-        for name, rec in self.items():
-            if rec['timestamp'] < ts: del self[name]
+        heap = self._timestamp_heap
+        while heap and heap[0] < ts:
+            for name in self._by_timestamp.pop(heapq.heappop(heap)): self._remove(name)
 
-    def sync(self):
-        """Synchronize reality with the database contents.  This
-method does a lot of things, and it's currently called after every
-single batch of database changes (a GetSlivers(), a loan, a record).
-It may be necessary in the future to do something smarter."""
+    def sync(self, full=False):
+        """Synchronize reality with the database contents.  This is
+called after every single batch of database changes (a GetSlivers(),
+a loan, a record), so only the slivers whose record was marked dirty
+since the last call are handled, unless <full> is set.  Every
+AUDIT_PERIOD seconds, all records and accounts get checked anyway,
+to catch up with whatever happened behind our back.  The actual work
+is queued in the accounts workers; this returns without waiting for it."""
 
         # delete expired records
         now = time.time()
-        for name, rec in self.items():
-            if rec.get('expires', now) < now: del self[name]
+        while True:
+            expires = self.next_expiry()
+            if expires is None or expires >= now: break
+            (expires, name) = heapq.heappop(self._expiry_heap)
+            logger.verbose("database: sync : %s expired"%name)
+            self._remove(name)
 
-        self._compute_effective_rspecs()
+        if now >= self._next_audit: full = True
+        dirty = self._dirty_names()
+        if full: rspecs_changed = self._update_effective_rspecs()
+        else: rspecs_changed = self._update_effective_rspecs(list(dirty))
+        # loans affect both ends, whoever made the change
+        dirty.update(rspecs_changed)
+        if full:
+            logger.verbose("database: sync : full audit of %d records"%len(self))
+            self._next_audit = now + AUDIT_PERIOD
+        elif dirty:
+            logger.verbose("database: sync : %d dirty records: %s"%(len(dirty),", ".join(dirty)))
+        cyclestats.set_value('database.dirty', len(dirty))
 
-        try:
-            x = coresched.CoreSched()
-            x.adjustCores(self)
-        except:
-            logger.log_exc("database: exception while doing core sched")
+        # the core allocation depends on the other slivers, so any change may affect everyone
+        if full or dirty:
+            try:
+                x = coresched.CoreSched()
+                x.adjustCores(self)
+            except:
+                logger.log_exc("database: exception while doing core sched")
 
         # create and destroy accounts as needed
-        logger.verbose("database: sync : fetching accounts")
-        existing_acct_names = accounts.all()
-        for name in existing_acct_names:
-            if name not in self:
-                logger.verbose("database: sync : ensure_destroy'ing %s"%name)
-                accounts.get(name).ensure_destroyed()
-        for name, rec in self.iteritems():
+        if full:
+            logger.verbose("database: sync : fetching accounts")
+            # the pre-built vservers in the pool are not slivers yet
+            doomed = [ name for name in accounts.all() if name not in self ]
+            names = self.keys()
+        else:
+            doomed = [ name for name in dirty if name not in self ]
+            names = [ name for name in dirty if name in self ]
+        # whatever happens next, these have been taken care of
+        changed = None
+        if not full: changed = set(dirty)
+        dirty.clear()
+        for name in doomed:
+            logger.verbose("database: sync : ensure_destroy'ing %s"%name)
+            accounts.get(name).ensure_destroyed()
+        for name in names:
+            rec = self[name]
             # protect this; if anything fails for a given sliver
             # we still need the other ones to be handled
             try:
@@ -154,6 +359,14 @@ It may be necessary in the future to do something smarter."""
                         sliver.ensure_created(rec)
             except:
                 logger.log_exc("database: sync failed to handle sliver",name=name)
+                # try again next time
+                self.mark_dirty(name)
+
+        # the workers of the accounts destroyed at the previous syncs are done by now
+        accounts.sweep()
+
+        self._publish(changed)
+        schedule_expiry(self.next_expiry())
 
         # Wake up bwmom to update limits.
         bwmon.lock.set()
@@ -162,33 +375,228 @@ It may be necessary in the future to do something smarter."""
         db_cond.notify()
 
 
+@synchronized
+def sliver_started(name):
+    """Called by the accounts workers: the cgroup of a sliver only exists once
+it is started, which happens after the sync that created it, so the
+cores reserved for it must be applied again at the next sync."""
+    db.mark_dirty(name)
+
+
+@synchronized
+def sliver_failed(name):
+    """Called by the accounts workers when an operation on a sliver failed,
+so that it gets retried at the next sync rather than at the next audit."""
+    db.mark_dirty(name)
+
+
+# fires when the next record expires, so that expiry does not wait for an unrelated sync
+expiry_timer = None
+expiry_time = None
+
+def schedule_expiry(when):
+    """Have expire() called at time <when>, or never if None"""
+    global expiry_timer, expiry_time
+    if when == expiry_time: return
+    if expiry_timer: expiry_timer.cancel()
+    expiry_timer = None
+    expiry_time = when
+    if when is None: return
+    # records expire once the time is past their 'expires'
+    expiry_timer = threading.Timer(max(0, when - time.time()) + 1, expire)
+    expiry_timer.setDaemon(True)
+    expiry_timer.start()
+
+@synchronized
+def expire():
+    """Get rid of expired records, and of their slivers"""
+    global expiry_time
+    expiry_time = None
+    logger.verbose("database: expiry timer fired")
+    db.sync()
+
+
+class Journal:
+    """Stores the successive snapshots of the database on disk.
+DB_FILE is a checkpoint: a whole snapshot, pickled.  Each later snapshot
+gets appended to DB_JOURNAL as an entry that only has what changed since
+the previous one: the records that changed, the names of the records
+that went away, and the names of the records whose timestamp was the
+only change.  Entries carry the snapshot version, so that the ones
+older than the checkpoint get ignored, should we have crashed between
+writing the checkpoint and truncating the journal.  When the journal
+gets too large, a new checkpoint is written."""
+
+    def __init__(self, checkpoint_file, journal_file):
+        self.checkpoint_file = checkpoint_file
+        self.journal_file = journal_file
+        # the last snapshot written, the next entry is relative to it
+        self.previous = None
+        self.checkpoint_size = 0
+        self.journal_size = 0
+
+    def write(self, snap):
+        """Store <snap>; return False if there was nothing to store"""
+        if self.previous is None or self.journal_size > max(JOURNAL_MIN_SIZE, self.checkpoint_size):
+            self.checkpoint(snap)
+            return True
+        entry = self.diff(self.previous, snap)
+        if entry is None: return False
+        pickled = cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL)
+        # not buffered, so that a failed write leaves nothing behind once truncated
+        fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600)
+        try:
+            offset = os.lseek(fd, 0, 2)
+            try: write_fully(fd, pickled)
+            except:
+                # a partial entry would hide all the entries appended after it at replay time
+                try: os.ftruncate(fd, offset)
+                except OSError:
+                    # start over with a checkpoint next time
+                    self.previous = None
+                raise
+        finally: os.close(fd)
+        self.journal_size += len(pickled)
+        self.previous = snap
+        logger.verbose("database: journaled version %d, %d records changed, %d deleted" % \
+                           (snap.version, len(entry['set']), len(entry['del'])))
+        return True
+
+    def checkpoint(self, snap):
+        pickled = cPickle.dumps(snap, cPickle.HIGHEST_PROTOCOL)
+        # the new checkpoint must be on disk, under its final name, before the journal goes away
+        directory = os.path.dirname(self.checkpoint_file) or '.'
+        (fd, temporary) = tempfile.mkstemp(dir=directory)
+        try:
+            try: write_fully(fd, pickled)
+            finally: os.close(fd)
+            os.rename(temporary, self.checkpoint_file)
+        except:
+            try: os.unlink(temporary)
+            except OSError: pass
+            raise
+        fd = os.open(directory, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+        f = open(self.journal_file, 'wb')
+        f.close()
+        self.checkpoint_size = len(pickled)
+        self.journal_size = 0
+        self.previous = snap
+        logger.verbose("database: checkpointed version %d, %d records" % (snap.version, len(snap)))
+
+    def diff(self, previous, snap):
+        """What changed between two snapshots, or None if nothing did"""
+        # unchanged records are shared between snapshots, see Database._publish
+        changed = {}
+        touched = []
+        for name, rec in snap.iteritems():
+            old_rec = previous.get(name)
+            if rec is old_rec: continue
+            if old_rec is not None and only_timestamp_differs(old_rec, rec): touched.append(name)
+            else: changed[name] = rec
+        deleted = [ name for name in previous.iterkeys() if name not in snap ]
+        if not changed and not touched and not deleted and snap._min_timestamp == previous._min_timestamp:
+            return None
+        timestamps = {}
+        for name in touched: timestamps.setdefault(snap[name]['timestamp'], []).append(name)
+        return {'version': snap.version, 'min_timestamp': snap._min_timestamp,
+                'set': changed, 'del': deleted, 'timestamps': timestamps}
+
+    def set_aside(self):
+        """Rename the checkpoint and the journal out of the way, and return the new name of the checkpoint"""
+        suffix = time.strftime('.unreadable-%Y%m%d-%H%M%S')
+        for filename in (self.journal_file, self.checkpoint_file):
+            if os.path.exists(filename): os.rename(filename, filename + suffix)
+        return self.checkpoint_file + suffix
+
+    def replay(self, db):
+        """Apply to <db>, as loaded from the checkpoint, the entries found in the journal"""
+        try: f = open(self.journal_file, 'rb')
+        except IOError: return
+        entries = 0
+        try:
+            while True:
+                try: entry = cPickle.load(f)
+                except EOFError: break
+                except Exception, e:
+                    # the entry being written when we crashed; the next checkpoint takes care of it
+                    logger.log("database: ignoring the tail of %s after %d entries (%r)" % (self.journal_file, entries, e))
+                    break
+                entries += 1
+                if entry['version'] <= getattr(db, 'version', 0): continue
+                db._min_timestamp = entry['min_timestamp']
+                for name in entry['del']: db.pop(name, None)
+                db.update(entry['set'])
+                for timestamp, names in entry['timestamps'].iteritems():
+                    for name in names:
+                        if name in db: db[name]['timestamp'] = timestamp
+                db.version = entry['version']
+        finally: f.close()
+        logger.log("database: replayed %d journal entries, now at version %d" % (entries, getattr(db, 'version', 0)))
+
+def write_fully(fd, data):
+    """Write <data> to file descriptor <fd>, and flush it to disk"""
+    written = 0
+    while written < len(data): written += os.write(fd, data[written:])
+    os.fsync(fd)
+
+def equal_but_timestamp(old_rec, rec):
+    if len(old_rec) != len(rec): return False
+    for key, value in rec.iteritems():
+        if key != 'timestamp' and (key not in old_rec or old_rec[key] != value): return False
+    return True
+
+def only_timestamp_differs(old_rec, rec):
+    if len(old_rec) != len(rec): return False
+    for key, value in rec.iteritems():
+        if key != 'timestamp' and old_rec.get(key) is not value: return False
+    return True
+
+
 def start():
     """The database dumper daemon.
 When it starts up, it populates the database with the last dumped database.
 It proceeds to handle dump requests forever."""
+    journal = Journal(DB_FILE, DB_JOURNAL)
+    accounts.started_callbacks.append(sliver_started)
+    accounts.failed_callbacks.append(sliver_failed)
     def run():
         global dump_requested
         while True:
             db_lock.acquire()
             while not dump_requested: db_cond.wait()
-            db_pickle = cPickle.dumps(db, cPickle.HIGHEST_PROTOCOL)
             dump_requested = False
             db_lock.release()
+            # the snapshot does not change, no need to hold the lock while writing it
+            snap = snapshot()
             try:
-                tools.write_file(DB_FILE, lambda f: f.write(db_pickle))
-                logger.log_database(db)
+                if journal.write(snap): logger.log_database(snap)
             except:
                 logger.log_exc("database.start: failed to pickle/dump")
-    global db
-    try:
-        f = open(DB_FILE)
-        try: db = cPickle.load(f)
-        finally: f.close()
-    except IOError:
-        logger.log ("database: Could not load %s -- starting from a fresh database"%DB_FILE)
-        db = Database()
-    except:
-        logger.log_exc("database: failed in start")
-        db = Database()
+    global db, version
+    db = None
+    if not os.path.exists(DB_FILE):
+        logger.log ("database: no %s -- starting from a fresh database"%DB_FILE)
+    else:
+        try:
+            f = open(DB_FILE, 'rb')
+            try: db = cPickle.load(f)
+            finally: f.close()
+            journal.replay(db)
+        except:
+            db = None
+            # the first checkpoint would overwrite it, keep it for whoever investigates
+            try: kept = journal.set_aside()
+            except OSError: kept = DB_FILE
+            logger.log_exc("database: COULD NOT LOAD %s, kept as %s -- STARTING FROM AN EMPTY DATABASE, "
+                           "records and loans made through the API are lost" % (DB_FILE, kept))
+    if db is None: db = Database()
+    # so that versions keep increasing across restarts
+    version = getattr(db, 'version', 0)
+    db._reindex()
+    # the accounts may have changed while we were not running
+    db.request_audit()
+    db._publish(None)
     logger.log('database.start')
     tools.as_daemon_thread(run)
@@ -0,0 +1,144 @@
+"""Persistent disk usage figures for the slivers.
+
+Setting a sliver's disk limit for the first time needs its current
+usage, in blocks and inodes, which VServer.init_disk_info computes by
+walking the whole /vservers/<name> tree.  Doing this for every sliver
+after a reboot keeps the disks busy for a long time, so the results are
+kept in CACHE_FILE, along with when they were computed and the
+(st_dev, st_ino) of the sliver's directory, which changes when the
+vserver or its filesystem gets recreated.  The file is written at most
+every SAVE_DELAY seconds.
+
+An entry older than MAX_AGE is still used, but flagged as stale: the
+walk is redone in the background by a single thread, rather than on
+the sync path.
+"""
+
+import os
+import time
+import threading
+
+import logger
+import tools
+import snapshot
+import cyclestats
+
+CACHE_FILE = '/var/lib/nodemanager/diskusage.pickle'
+VERSION = 2
+MAX_AGE = 24*3600
+SAVE_DELAY = 10
+
+lock = threading.Lock()
+# name -> (key, computed, blocks, inodes); loaded on first use
+entries = None
+# writes CACHE_FILE, once the changes have settled down
+save_timer = None
+# held while writing CACHE_FILE, so that an older copy cannot overwrite a newer one
+save_lock = threading.Lock()
+# names waiting for a refresh, and the corresponding callbacks
+queue = []
+callbacks = {}
+cond = threading.Condition(lock)
+started = False
+
+def key(path):
+    """What identifies the filesystem tree at <path>, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino)
+    except OSError:
+        return None
+
+def _load():
+    """To be called with lock held"""
+    global entries
+    if entries is not None: return
+    entries = {}
+    try:
+        cached = snapshot.load(CACHE_FILE)
+        if cached.get('version') == VERSION: entries = cached['entries']
+    except Exception, e:
+        logger.verbose("diskusage: no usable %s (%s)" % (CACHE_FILE, e))
+
+def _save_later():
+    """To be called with lock held"""
+    global save_timer
+    if save_timer is not None: return
+    save_timer = threading.Timer(SAVE_DELAY, save)
+    save_timer.setDaemon(True)
+    save_timer.start()
+
+def save():
+    global save_timer
+    save_lock.acquire()
+    try:
+        lock.acquire()
+        try:
+            save_timer = None
+            data = {'version': VERSION, 'entries': entries.copy()}
+        finally: lock.release()
+        try: snapshot.dump(CACHE_FILE, data)
+        except: logger.log_exc("diskusage: could not save %s" % CACHE_FILE)
+    finally: save_lock.release()
+
+def lookup(name, path):
+    """Return (blocks, inodes, fresh) as last computed for sliver <name> in <path>, or None if unknown"""
+    path_key = key(path)
+    lock.acquire()
+    try:
+        _load()
+        entry = entries.get(name)
+        if entry is None or path_key is None or entry[0] != path_key:
+            return None
+        (entry_key, computed, blocks, inodes) = entry
+    finally: lock.release()
+    fresh = time.time() - computed < MAX_AGE
+    if fresh: cyclestats.incr('diskusage.hits')
+    else: cyclestats.incr('diskusage.stale')
+    return (blocks, inodes, fresh)
+
+def store(name, path, blocks, inodes):
+    """Record that sliver <name> in <path> uses <blocks> and <inodes>"""
+    path_key = key(path)
+    lock.acquire()
+    try:
+        _load()
+        entries[name] = (path_key, time.time(), blocks, inodes)
+        _save_later()
+    finally: lock.release()
+    cyclestats.incr('diskusage.scans')
+
+def forget(name):
+    lock.acquire()
+    try:
+        _load()
+        if name in entries:
+            del entries[name]
+            _save_later()
+    finally: lock.release()
+
+def refresh_later(name, callback):
+    """Have <callback> called in the background, to compute the usage of sliver <name> again"""
+    global started
+    lock.acquire()
+    try:
+        callbacks[name] = callback
+        if name not in queue: queue.append(name)
+        if not started:
+            started = True
+            tools.as_daemon_thread(run)
+        cond.notify()
+    finally: lock.release()
+
+def run():
+    """The refresher thread"""
+    while True:
+        lock.acquire()
+        try:
+            while not queue: cond.wait()
+            name = queue.pop(0)
+            callback = callbacks.pop(name)
+        finally: lock.release()
+        logger.verbose("diskusage: refreshing %s" % name)
+        try: callback()
+        except: logger.log_exc("diskusage: refresh failed", name=name)
@@ -6,6 +6,7 @@ import time
 import traceback
 import subprocess
 import select
+import threading
 
 LOG_FILE    = '/var/log/nodemanager'
 LOG_SLIVERS = '/var/lib/nodemanager/getslivers.txt'
@@ -53,13 +54,14 @@ def log_exc(msg="",name=None):
 def log_missing_data (msg,key):
     log("%s: could not find the %s key in data (PLC connection down?) - IGNORED"%(msg,key))
 
-def log_data_in_file (data, file, message="",level=LOG_NODE):
+def log_data_in_file (data, file, message="",level=LOG_NODE,when=None):
     if (level > LOG_LEVEL):
         return
     import pprint, time
+    if when is None: when=time.time()
     try:
         f=open(file,'w')
-        now=time.strftime("Last update: %Y.%m.%d at %H:%M:%S %Z", time.localtime())
+        now=time.strftime("Last update: %Y.%m.%d at %H:%M:%S %Z", time.localtime(when))
         f.write(now+'\n')
         if message: f.write('Message:'+message+'\n')
         pp=pprint.PrettyPrinter(stream=f,indent=2)
@@ -71,9 +73,49 @@ def log_data_in_file (data, file, message="",level=LOG_NODE):
 
 def log_slivers (data):
     log_data_in_file (data, LOG_SLIVERS, "raw GetSlivers")
+def log_slivers_background (pickled):
+    log_pickle_in_file_background (pickled, LOG_SLIVERS, "raw GetSlivers")
 def log_database (db):
     log_data_in_file (db, LOG_DATABASE, "raw database")
 
+########## same, from a low-priority background thread
+# pretty-printing large structures is slow, and there is no need to do it on the sync path;
+# the data is passed pickled, so the caller is free to modify the original afterwards
+# file -> (pickled data, message, time) - only the latest version of each file gets written
+pending_dumps = {}
+pending_dumps_cond = threading.Condition()
+dumper_thread = None
+
+def log_pickle_in_file_background (pickled, file, message="", level=LOG_NODE):
+    global dumper_thread
+    if (level > LOG_LEVEL):
+        return
+    pending_dumps_cond.acquire()
+    try:
+        pending_dumps[file] = (pickled, message, time.time())
+        if dumper_thread is None:
+            dumper_thread = threading.Thread(target=dumper)
+            dumper_thread.setDaemon(True)
+            dumper_thread.start()
+        pending_dumps_cond.notify()
+    finally: pending_dumps_cond.release()
+
+def dumper ():
+    import cPickle
+    # on linux this only affects the calling thread
+    try: os.nice(10)
+    except OSError: pass
+    while True:
+        pending_dumps_cond.acquire()
+        try:
+            while not pending_dumps: pending_dumps_cond.wait()
+            (file, (pickled, message, when)) = pending_dumps.popitem()
+        finally: pending_dumps_cond.release()
+        try:
+            log_data_in_file (cPickle.loads(pickled), file, message, when=when)
+        except:
+            log_exc('logger.dumper failed - file=%s'%file)
+
 #################### child processes
 # avoid waiting until the process returns;
 # that makes debugging of hanging children hard
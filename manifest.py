@@ -0,0 +1,126 @@
+"""A cached manifest of the plugins, and plugins that get imported lazily.
+
+Importing every plugin at startup delays the first sync, sometimes a
+lot: some of them pull in large libraries (sfagids imports the whole
+SFA stack), whether or not they turn out to be useful.  Yet all
+nodemanager needs upfront to schedule a plugin are a few properties:
+priority, persistent_data, use_changeset and timeout.
+
+These are found by scanning the plugin's source for top-level
+assignments of literal values, and kept in MANIFEST_FILE along with the
+file's mtime and size, so that only the plugins that changed get
+scanned again.  A plugin whose properties cannot be found that way
+(e.g. they are computed) is imported at startup as before.
+
+The other ones are represented by a LazyModule, which imports and
+starts the actual module right before its first GetSlivers.
+"""
+
+import os
+import re
+import glob
+import threading
+
+import logger
+import snapshot
+import cyclestats
+
+MANIFEST_FILE = "/var/lib/nodemanager/plugins.manifest"
+VERSION = 1
+
+PROPERTIES = ('priority', 'persistent_data', 'use_changeset', 'timeout')
+
+property_re = re.compile(r"^(%s)\s*=\s*([^#\s]+)\s*(?:#.*)?$" % "|".join(PROPERTIES), re.M)
+
+def scan(filename):
+    """Return the properties set in plugin <filename>, or None if they cannot be found without importing it"""
+    try:
+        f = open(filename)
+        try: source = f.read()
+        finally: f.close()
+    except IOError, e:
+        logger.log("manifest: cannot read %s: %s" % (filename, e))
+        return None
+    properties = {}
+    for (name, value) in property_re.findall(source):
+        if value in ('True', 'False'):
+            properties[name] = (value == 'True')
+        else:
+            try: properties[name] = int(value)
+            except ValueError: return None
+    return properties
+
+def load(directory):
+    """Return a dict plugin name -> properties (or None) for the plugins in <directory>"""
+    try:
+        cached = snapshot.load(MANIFEST_FILE)
+    except Exception, e:
+        logger.verbose("manifest: no usable %s (%s)" % (MANIFEST_FILE, e))
+        cached = {}
+    entries = {}
+    if cached.get('version') == VERSION and cached.get('directory') == directory:
+        entries = cached.get('plugins', {})
+    plugins = {}
+    changed = False
+    for filename in glob.glob(os.path.join(directory, '*.py')):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        try: st = os.stat(filename)
+        except OSError: continue
+        stamp = (st.st_mtime, st.st_size)
+        entry = entries.get(name)
+        if entry is None or entry[0] != stamp:
+            logger.verbose("manifest: scanning %s" % filename)
+            entry = (stamp, scan(filename))
+            changed = True
+        plugins[name] = entry
+    if changed or len(plugins) != len(entries):
+        try:
+            snapshot.dump(MANIFEST_FILE, {'version': VERSION, 'directory': directory, 'plugins': plugins})
+        except Exception, e:
+            logger.log("manifest: could not save %s: %s" % (MANIFEST_FILE, e))
+    result = {}
+    for (name, (stamp, properties)) in plugins.items():
+        result[name] = properties
+    return result
+
+
+class LazyModule:
+    """Stands in for a plugin until its GetSlivers is first called"""
+
+    def __init__(self, name, properties):
+        self.__name__ = name
+        for (key, value) in properties.items():
+            setattr(self, key, value)
+        self.module = None
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Import and start the actual module, once; return it, or None if it cannot be imported"""
+        self.lock.acquire()
+        try:
+            if self.module is None and not self.failed:
+                timer = cyclestats.start('import.%s' % self.__name__)
+                try:
+                    module = __import__(self.__name__)
+                    logger.verbose("manifest: triggering %s.start" % self.__name__)
+                    module.start()
+                    # the module has the last word, should the scan have missed something
+                    for key in PROPERTIES:
+                        if hasattr(module, key): setattr(self, key, getattr(module, key))
+                    self.module = module
+                except ImportError, err:
+                    logger.log("manifest: could not import plugin %s: %s" % (self.__name__, err))
+                    self.failed = True
+                timer.stop()
+            return self.module
+        finally: self.lock.release()
+
+    def GetSlivers(self, *args, **kwds):
+        module = self.load()
+        if module is None: return
+        return module.GetSlivers(*args, **kwds)
+
+    def __repr__(self):
+        if self.module is not None: return repr(self.module)
+        return "<lazy plugin %r>" % self.__name__
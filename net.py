@@ -15,8 +15,13 @@ import bwlimit, logger, iptables, tools
 # we can't do anything without a network
 priority=1
 
-dev_default = tools.get_default_if()
+# the default interface, found when first needed rather than at import time
+dev_default = None
 
+def get_dev_default():
+    global dev_default
+    if dev_default is None: dev_default = tools.get_default_if()
+    return dev_default
 
 def start():
     logger.log("net: plugin starting up...")
@@ -45,7 +50,7 @@ def GetSlivers(data, config, plc):
     if 'OVERRIDES' in dir(config):
         if config.OVERRIDES.get('net_max_rate') == '-1':
             logger.log("net: Slice and node BW Limits disabled.")
-            if len(bwlimit.tc("class show dev %s" % dev_default)):
+            if len(bwlimit.tc("class show dev %s" % get_dev_default())):
                 logger.verbose("net: *** DISABLING NODE BW LIMITS ***")
                 bwlimit.stop()
         else:
@@ -16,16 +16,26 @@ import socket
 import os
 import sys
 import resource
-import glob
-import pickle
+import threading
 
 import logger
 import tools
+import accounts
+import changeset
+import cyclestats
+import synctrigger
+import pollpolicy
+import prefetch
+import snapshot
+import sliversview
+import manifest
+import plctrace
 
 from config import Config
 from plcapi import PLCAPI
-import random
 
+# when this process started, to measure the time to the first sync
+started=time.time()
 
 class NodeManager:
 
@@ -42,6 +52,13 @@ class NodeManager:
     default_period=600
     default_random=301
     default_priority=100
+    default_min_gap=60
+    default_max_backoff=3600
+    # PLC calls never time out sooner than this, whatever the measured response times
+    min_plc_timeout=30
+    default_jobs=1
+    # time budget for one module's GetSlivers, unless it sets its own 'timeout' property
+    default_timeout=900
 
     def __init__ (self):
 
@@ -60,6 +77,27 @@ class NodeManager:
                           help='more verbose log')
         parser.add_option('-P', '--path', action='store', dest='path', default=NodeManager.PLUGIN_PATH,
                           help='Path to plugins directory')
+        parser.add_option('-b', '--max-backoff', action='store', dest='max_backoff', default=NodeManager.default_max_backoff,
+                          help='Max. polling interval (sec) when PLC keeps failing -- default %d'%NodeManager.default_max_backoff)
+        parser.add_option('-g', '--min-gap', action='store', dest='min_gap', default=NodeManager.default_min_gap,
+                          help='Min. interval (sec) between two syncs, when triggered early -- default %d'%NodeManager.default_min_gap)
+        parser.add_option('--prefetch', action='store_true', dest='prefetch', default=False,
+                          help='fetch the next GetSlivers in the background, while the modules are running or just before the next sync is due')
+        parser.add_option('-j', '--jobs', action='store', dest='jobs', default=NodeManager.default_jobs,
+                          help='Max. number of modules with the same priority run concurrently -- default %d (serial)'%NodeManager.default_jobs)
+        parser.add_option('--sliver-jobs', action='store', dest='sliver_jobs', default=accounts.DEFAULT_JOBS,
+                          help='Max. number of sliver operations run concurrently -- default %d'%accounts.DEFAULT_JOBS)
+        parser.add_option('--sliver-limits', action='store', dest='sliver_limits', default='',
+                          help='Max. number of concurrent sliver creations, destructions and starts, e.g. create=2,start=4 -- default %s'%\
+                              ','.join(['%s=%d'%item for item in accounts.DEFAULT_LIMITS.items()]))
+        parser.add_option('--eager', action='store_true', dest='eager', default=False,
+                          help='import all plugins at startup, rather than right before they are first needed')
+        parser.add_option('--record', action='store', dest='record', default=None,
+                          help='record all calls to PLC, with their results and latencies, in this trace file')
+        parser.add_option('--replay', action='store', dest='replay', default=None,
+                          help='answer calls to PLC from this trace file, instead of the network')
+        parser.add_option('--replay-fast', action='store_true', dest='replay_fast', default=False,
+                          help='with --replay, do not reproduce the recorded latencies and delays')
 
         # NOTE: BUG the 'help' for this parser.add_option() wont list plugins from the --path argument
         parser.add_option('-m', '--module', action='store', dest='user_module', default='', help='run a single module')
@@ -70,52 +108,231 @@ class NodeManager:
             sys.exit(1)
 
         # determine the modules to be run
-        self.modules = NodeManager.core_modules
-        # Deal with plugins directory
+        self.modules = NodeManager.core_modules[:]
+        # Deal with plugins directory; the manifest tells how to schedule them without importing them
+        self.plugins = {}
         if os.path.exists(self.options.path):
             sys.path.append(self.options.path)
-            plugins = [ os.path.split(os.path.splitext(x)[0])[1] for x in glob.glob( os.path.join(self.options.path,'*.py') ) ]
+            self.plugins = manifest.load(self.options.path)
+            plugins = self.plugins.keys()
+            plugins.sort()
             self.modules += plugins
         if self.options.user_module:
             assert self.options.user_module in self.modules
             self.modules=[self.options.user_module]
             logger.verbose('nodemanager: Running single module %s'%self.options.user_module)
 
-
-    def GetSlivers(self, config, plc):
-        """Retrieves GetSlivers at PLC and triggers callbacks defined in modules/plugins"""
+        # how many sliver operations run in parallel
+        sliver_limits={}
+        try:
+            for limit in [ item for item in self.options.sliver_limits.split(',') if item ]:
+                (kind,value)=limit.split('=')
+                sliver_limits[kind.strip()]=int(value)
+            accounts.set_concurrency(int(self.options.sliver_jobs), sliver_limits)
+        except ValueError, e:
+            parser.error('invalid --sliver-jobs or --sliver-limits: %s'%e)
+
+        # how often we poll PLC, and with what timeout
+        iperiod=int(self.options.period)
+        self.poll_policy = pollpolicy.PollPolicy(iperiod, int(self.options.random), int(self.options.max_backoff),
+                                                 NodeManager.min_plc_timeout, iperiod/2)
+
+        # set in run() when running with --prefetch
+        self.prefetcher = None
+        self.next_sync = None
+        # set in run() when running with --replay
+        self.player = None
+
+        # the snapshot of the last GetSlivers that was successfully fetched
+        self.last_snapshot = None
+        # modules whose callback failed, and that need to see everything again next time
+        self.modules_need_full = set()
+        # watchdog: the thread running each module's callback, and how many times it overran/got skipped
+        self.module_threads = {}
+        self.module_overruns = {}
+        self.module_skips = {}
+        # changeset.checksum of what DB_FILE currently holds, so identical data does not get rewritten
+        self.dumped_checksum = None
+        try: self.dumped_checksum = changeset.checksum(snapshot.load(NodeManager.DB_FILE))
+        except: pass
+        # same for the debug dump in logger.LOG_SLIVERS, that gets written at least once
+        self.logged_checksum = None
+        # when the first cycle completed
+        self.first_sync = None
+
+
+    def GetSlivers(self, config, plc, prefetched=None):
+        """Retrieves GetSlivers at PLC and triggers callbacks defined in modules/plugins
+If prefetched is set, it is a prefetch.Fetch whose result is used instead of calling PLC"""
+        # None means everything is to be considered as changed
+        changes = None
+        cycle_timer = cyclestats.start('cycle')
+        fetched = False
         try:
             logger.log("nodemanager: Syncing w/ PLC")
             # retrieve GetSlivers from PLC
-            data = plc.GetSlivers()
+            timer = cyclestats.start('plc.GetSlivers')
+            if prefetched is not None:
+                logger.log("nodemanager: using GetSlivers prefetched %d s ago"%(time.time()-prefetched.started))
+                data = prefetched.result()
+                latency = prefetched.latency
+                timer.stop()
+            else:
+                data = plc.GetSlivers()
+                latency = timer.stop()
+            fetched = True
+            self.poll_policy.success(latency)
             # use the magic 'default' slice to retrieve system-wide defaults
+            timer = cyclestats.start('getPLCDefaults')
             self.getPLCDefaults(data, config)
+            timer.stop()
             # tweak the 'vref' attribute from GetSliceFamily
+            timer = cyclestats.start('setSliversVref')
             self.setSliversVref (data)
+            timer.stop()
             # dump it too, so it can be retrieved later in case of comm. failure
-            self.dumpSlivers(data)
+            timer = cyclestats.start('dumpSlivers')
+            # the timestamp alone changes at every call
+            checksum = changeset.checksum(data)
+            payload = None
+            if checksum != self.dumped_checksum or checksum != self.logged_checksum:
+                payload = snapshot.encode(data)
+            self.dumpSlivers(payload, checksum)
+            timer.stop()
             # log it for debug purposes, no matter what verbose is
-            logger.log_slivers(data)
+            if checksum != self.logged_checksum:
+                logger.log_slivers_background(payload)
+                self.logged_checksum = checksum
+            # compare with what we had last time, for modules that can use it
+            timer = cyclestats.start('changeset')
+            current = changeset.Snapshot(data)
+            if self.last_snapshot is not None:
+                changes = changeset.Changeset(self.last_snapshot, current)
+                logger.verbose("nodemanager: changes since last sync: %r"%changes)
+            self.last_snapshot = current
+            timer.stop()
+            # index it once for all modules
+            timer = cyclestats.start('sliversview')
+            sliversview.get(data)
+            timer.stop()
+            cyclestats.set_value('slivers', len(data.get('slivers',[])))
             logger.verbose("nodemanager: Sync w/ PLC done")
             last_data=data
         except:
             logger.log_exc("nodemanager: failed in GetSlivers")
             #  XXX So some modules can at least boostrap.
             logger.log("nodemanager:  Can't contact PLC to GetSlivers().  Continuing.")
+            cyclestats.incr('plc.GetSlivers.failures')
+            if not fetched: self.poll_policy.failure()
             data = {}
             # for modules that request it though the 'persistent_data' property
             last_data=self.loadSlivers()
+        # adjust the timeout to the measured response times
+        if plc.timeout != self.poll_policy.timeout:
+            logger.verbose("nodemanager: PLC timeout set to %d s"%self.poll_policy.timeout)
+            plc.set_timeout(self.poll_policy.timeout)
+        # in pipelined mode, the next fetch can start while the modules are running
+        if self.prefetcher:
+            self.next_sync = cycle_timer.started + self.poll_policy.delay()
+            self.prefetcher.schedule(self.next_sync - self.poll_policy.expected_latency())
         #  Invoke GetSlivers() functions from the callback modules
+        def module_caller (module):
+            return lambda: self.run_module(module, data, last_data, changes, config, plc)
+        jobs=int(self.options.jobs)
+        if jobs <= 1:
+            for module in self.loaded_modules: self.run_module(module, data, last_data, changes, config, plc)
+        else:
+            # modules with the same priority run concurrently; we wait for a whole tier
+            # to complete before moving to the next one, so that e.g. net < conf_files < slivermanager is preserved
+            for tier in self.module_tiers():
+                if len(tier) > 1:
+                    logger.verbose('nodemanager: running tier %s concurrently'%[m.__name__ for m in tier])
+                tools.run_concurrently([ module_caller(module) for module in tier ], jobs)
+        cycle_timer.stop()
+        if self.first_sync is None:
+            self.first_sync = time.time()
+            self.report_first_sync()
+        cyclestats.write()
+
+
+    def report_first_sync(self):
+        """Log and record how long it took to complete the first cycle, since startup and since boot"""
+        since_start = self.first_sync - started
+        cyclestats.set_value('startup.first_sync', '%.3f' % since_start)
+        try:
+            uptime = float(open('/proc/uptime').read().split()[0])
+            since_boot = uptime - (time.time() - self.first_sync)
+            cyclestats.set_value('startup.first_sync_since_boot', '%.3f' % since_boot)
+            logger.log("nodemanager: first sync completed %.1f s after startup, %.1f s after boot" % (since_start, since_boot))
+        except (IOError, ValueError, IndexError):
+            logger.log("nodemanager: first sync completed %.1f s after startup" % since_start)
+
+
+    def run_module(self, module, data, last_data, changes, config, plc):
+        """Trigger the GetSlivers callback of one module, under the supervision of a watchdog.
+Each module has a time budget, set in its 'timeout' property; when it gets exceeded,
+we just move on and leave the callback alone. Until it returns, that module gets skipped."""
+        name=module.__name__
+        timeout=getattr(module,'timeout',NodeManager.default_timeout)
+        running=self.module_threads.get(name)
+        if running and running.isAlive():
+            self.module_skips[name]=self.module_skips.get(name,0)+1
+            cyclestats.set_value('module.%s.skips'%name, self.module_skips[name])
+            logger.log("nodemanager: %s.GetSlivers still running since %s -- skipped (%d times so far)"%\
+                           (name,time.asctime(time.gmtime(running.started)),self.module_skips[name]))
+            return
+        thread=threading.Thread(target=self.call_module, args=(module, data, last_data, changes, config, plc, timeout))
+        thread.setDaemon(True)
+        thread.started=time.time()
+        self.module_threads[name]=thread
+        thread.start()
+        thread.join(timeout)
+        if thread.isAlive():
+            self.module_overruns[name]=self.module_overruns.get(name,0)+1
+            cyclestats.set_value('module.%s.overruns'%name, self.module_overruns[name])
+            # it did not complete, so it will have to see everything next time
+            self.modules_need_full.add(name)
+            logger.log("nodemanager: %s.GetSlivers exceeded its budget of %d s -- moving on (%d overruns so far)"%\
+                           (name,timeout,self.module_overruns[name]))
+
+
+    def call_module(self, module, data, last_data, changes, config, plc, timeout):
+        """Actually call the GetSlivers callback of one module - runs in the module's thread"""
+        started=time.time()
+        logger.verbose('nodemanager: triggering %s.GetSlivers'%module.__name__)
+        try:
+            callback = getattr(module, 'GetSlivers')
+            module_data=data
+            if getattr(module,'persistent_data',False):
+                module_data=last_data
+            # modules that opt in through the 'use_changeset' property get the changes as well
+            if getattr(module,'use_changeset',False):
+                module_changes=changes
+                if module.__name__ in self.modules_need_full: module_changes=None
+                self.modules_need_full.discard(module.__name__)
+                callback(module_data, config, plc, changes=module_changes)
+            else:
+                callback(module_data, config, plc)
+        except:
+            logger.log_exc("nodemanager: GetSlivers failed to run callback for module %r"%module)
+            self.modules_need_full.add(module.__name__)
+        duration=time.time()-started
+        cyclestats.record('module.%s'%module.__name__, duration)
+        if duration > timeout:
+            logger.log("nodemanager: %s.GetSlivers eventually returned after %d s"%(module.__name__,duration))
+
+
+    def module_tiers(self):
+        """Group loaded_modules (already sorted) in lists of modules with the same priority"""
+        tiers=[]
+        current=None
         for module in self.loaded_modules:
-            logger.verbose('nodemanager: triggering %s.GetSlivers'%module.__name__)
-            try:
-                callback = getattr(module, 'GetSlivers')
-                module_data=data
-                if getattr(module,'persistent_data',False):
-                    module_data=last_data
-                callback(data, config, plc)
-            except:
-                logger.log_exc("nodemanager: GetSlivers failed to run callback for module %r"%module)
+            priority=getattr(module,'priority',NodeManager.default_priority)
+            if not tiers or priority != current:
+                tiers.append([])
+                current=priority
+            tiers[-1].append(module)
+        return tiers
 
 
     def getPLCDefaults(self, data, config):
@@ -153,23 +370,50 @@ class NodeManager:
             except:
                 logger.log_exc("nodemanager: Could not overwrite 'vref' attribute from 'GetSliceFamily'",name=sliver['name'])
 
-    def dumpSlivers (self, slivers):
-        f = open(NodeManager.DB_FILE, "w")
+    def dumpSlivers (self, payload, checksum):
+        """Store GetSlivers, as encoded by snapshot.encode, unless DB_FILE has it already, as told by changeset.checksum"""
+        if checksum == self.dumped_checksum:
+            logger.verbose("nodemanager: GetSlivers unchanged, %s left as is" % NodeManager.DB_FILE)
+            cyclestats.incr('dumpSlivers.skipped')
+            return
         logger.log ("nodemanager: saving successfully fetched GetSlivers in %s" % NodeManager.DB_FILE)
-        pickle.dump(slivers, f)
-        f.close()
+        snapshot.write(NodeManager.DB_FILE, payload)
+        self.dumped_checksum = checksum
+        cyclestats.incr('dumpSlivers.writes')
 
     def loadSlivers (self):
         try:
-            f = open(NodeManager.DB_FILE, "r+")
             logger.log("nodemanager: restoring latest known GetSlivers from %s" % NodeManager.DB_FILE)
-            slivers = pickle.load(f)
-            f.close()
-            return slivers
-        except:
-            logger.log("Could not restore GetSlivers from %s" % NodeManager.DB_FILE)
+            return snapshot.load(NodeManager.DB_FILE)
+        except Exception, e:
+            logger.log("Could not restore GetSlivers from %s: %s" % (NodeManager.DB_FILE, e))
             return {}
 
+    def load_modules(self):
+        """Import and start the modules, and sort them in self.loaded_modules"""
+        self.loaded_modules = []
+        for module in self.modules:
+            # plugins get imported right before their first GetSlivers
+            if not self.options.eager and self.plugins.get(module) is not None:
+                self.loaded_modules.append(manifest.LazyModule(module, self.plugins[module]))
+                continue
+            try:
+                m = __import__(module)
+                logger.verbose("nodemanager: triggering %s.start"%m.__name__)
+                m.start()
+                self.loaded_modules.append(m)
+            except ImportError, err:
+                print "Warning while loading module %s:" % module, err
+
+        # sort on priority (lower first)
+        def sort_module_priority (m1,m2):
+            return getattr(m1,'priority',NodeManager.default_priority) - getattr(m2,'priority',NodeManager.default_priority)
+        self.loaded_modules.sort(sort_module_priority)
+
+        logger.log('ordered modules:')
+        for module in self.loaded_modules:
+            logger.log ('%s: %s'%(getattr(module,'priority',NodeManager.default_priority),module.__name__))
+
     def run(self):
         try:
             if self.options.daemon: tools.daemon()
@@ -190,25 +434,14 @@ If this is not the case, please remove the pid file %s. -- exiting""" % (other_p
             except OSError, err:
                 print "Warning while writing PID file:", err
 
-            # load modules
-            self.loaded_modules = []
-            for module in self.modules:
-                try:
-                    m = __import__(module)
-                    logger.verbose("nodemanager: triggering %s.start"%m.__name__)
-                    m.start()
-                    self.loaded_modules.append(m)
-                except ImportError, err:
-                    print "Warning while loading module %s:" % module, err
-
-            # sort on priority (lower first)
-            def sort_module_priority (m1,m2):
-                return getattr(m1,'priority',NodeManager.default_priority) - getattr(m2,'priority',NodeManager.default_priority)
-            self.loaded_modules.sort(sort_module_priority)
-
-            logger.log('ordered modules:')
-            for module in self.loaded_modules:
-                logger.log ('%s: %s'%(getattr(module,'priority',NodeManager.default_priority),module.__name__))
+            # early syncs can be requested through SIGUSR1, a touch file, or the API;
+            # right away, as SIGUSR1 would otherwise kill us once the pid file is there
+            try: synctrigger.install_signal_handler()
+            except ValueError:
+                # signals can only be handled by the main thread
+                logger.log("nodemanager: not running in the main thread, SIGUSR1 will not trigger syncs")
+
+            self.load_modules()
 
             # Load /etc/planetlab/session
             if os.path.exists(self.options.session):
@@ -222,7 +455,8 @@ If this is not the case, please remove the pid file %s. -- exiting""" % (other_p
             irandom=int(self.options.random)
 
             # Initialize XML-RPC client
-            plc = PLCAPI(config.plc_api_uri, config.cacert, session, timeout=iperiod/2)
+            plc = self.make_plcapi(config, session)
+            logger.log("nodemanager: polling policy %r"%self.poll_policy)
 
             #check auth
             logger.log("nodemanager: Checking Auth.")
@@ -235,16 +469,61 @@ If this is not the case, please remove the pid file %s. -- exiting""" % (other_p
                 time.sleep(iperiod)
             logger.log("nodemanager: Authentication Succeeded!")
 
+            min_gap=int(self.options.min_gap)
+
+            # fetch the next GetSlivers in the background so it's ready when needed
+            if self.options.prefetch:
+                logger.log("nodemanager: prefetching GetSlivers")
+                self.prefetcher = prefetch.Prefetcher(plc, max_age=iperiod)
+            prefetched = None
 
             while True:
             # Main nodemanager Loop
                 logger.log('nodemanager: mainloop - calling GetSlivers - period=%d random=%d'%(iperiod,irandom))
-                self.GetSlivers(config, plc)
-                delay=iperiod + random.randrange(0,irandom)
-                logger.log('nodemanager: mainloop - sleeping for %d s'%delay)
-                time.sleep(delay)
+                last_sync=time.time()
+                self.GetSlivers(config, plc, prefetched)
+                if self.player:
+                    if not self.player.remaining('GetSlivers'):
+                        logger.log('nodemanager: mainloop - replay of %s complete'%self.options.replay)
+                        break
+                    delay=self.player.delay()
+                elif self.prefetcher:
+                    # the next sync was scheduled from the start of this one
+                    delay=max(0,self.next_sync-time.time())
+                else:
+                    delay=self.poll_policy.delay()
+                logger.log('nodemanager: mainloop - sleeping for %d s (%r)'%(delay,self.poll_policy))
+                reasons=synctrigger.wait(delay)
+                requested_at=None
+                if reasons:
+                    requested_at=time.time()
+                    # don't let a flurry of requests cause a flurry of syncs
+                    gap=time.time()-last_sync
+                    if gap < min_gap:
+                        logger.log('nodemanager: mainloop - sync requested (%s), delayed by %d s'%\
+                                       (", ".join(reasons),min_gap-gap))
+                        time.sleep(min_gap-gap)
+                        # requests that arrived in the meantime are served by this same sync
+                        reasons += synctrigger.collect()
+                    logger.log('nodemanager: mainloop - sync requested (%s)'%", ".join(reasons))
+                    cyclestats.incr('triggered_syncs')
+                if self.prefetcher:
+                    # when a sync was requested, the data must have been fetched after the request
+                    prefetched=self.prefetcher.take(not_before=requested_at)
         except: logger.log_exc("nodemanager: failed in run")
 
+    def make_plcapi(self, config, session):
+        """The PLCAPI to use, possibly recording calls to, or replaying them from, a trace file"""
+        if self.options.replay:
+            self.player=plctrace.Player(self.options.replay, self.options.replay_fast)
+            return plctrace.ReplayingPLCAPI(self.player, config.plc_api_uri, config.cacert, session,
+                                            timeout=self.poll_policy.timeout)
+        if self.options.record:
+            recorder=plctrace.Recorder(self.options.record, config.plc_api_uri)
+            return plctrace.RecordingPLCAPI(recorder, config.plc_api_uri, config.cacert, session,
+                                            timeout=self.poll_policy.timeout)
+        return PLCAPI(config.plc_api_uri, config.cacert, session, timeout=self.poll_policy.timeout)
+
 def run():
     logger.log("======================================== Entering nodemanager.py")
     NodeManager().run()
@@ -24,6 +24,7 @@ class PLCAPI:
         self.uri = uri
         self.cacert = cacert
         self.timeout = timeout
+        self.kwds = kwds
 
         if isinstance(auth, (tuple, list)):
             (self.node_id, self.key) = auth
@@ -34,7 +35,18 @@ class PLCAPI:
         else:
             self.node_id = self.key = self.session = None
 
-        self.server = safexmlrpc.ServerProxy(self.uri, self.cacert, self.timeout, allow_none = 1, **kwds)
+        self.server = self.make_server()
+
+
+    def make_server(self):
+        """Return the XML-RPC proxy that calls are sent to"""
+        return safexmlrpc.ServerProxy(self.uri, self.cacert, self.timeout, allow_none = 1, **self.kwds)
+
+
+    def set_timeout(self, timeout):
+        """Change the timeout for subsequent calls"""
+        self.timeout = timeout
+        self.server = self.make_server()
 
 
     def update_session(self, f="/usr/boot/plnode.txt"):
@@ -0,0 +1,219 @@
+"""Recording the calls made to PLC, and replaying them later.
+
+With --record <file>, nodemanager.py stores every call it makes to PLC
+in a trace file: the method, its parameters (without the auth struct),
+when it was made, how long it took, and its result or the error it
+raised.  With --replay <file>, the same calls are answered from the
+trace instead of the network, so that a production session can be
+reproduced on a development box.  Each method gets its recorded
+responses back in order.  By default the recorded latencies, and the
+gaps between GetSlivers calls, are reproduced; with --replay-fast they
+are not.
+
+A trace is a gzip'ed sequence of pickles: a header
+  (MAGIC, VERSION, start time, uri)
+then one tuple per call
+  (method, params, started, latency, outcome, value)
+where outcome is 'ok', 'fault' (value is (faultCode, faultString)) or
+'error' (value describes the exception).
+"""
+
+import sys
+import time
+import gzip
+import cPickle
+import xmlrpclib
+import threading
+
+import logger
+from plcapi import PLCAPI
+
+MAGIC = 'NMTRACE'
+VERSION = 1
+
+class TraceError(Exception): pass
+class EndOfTrace(TraceError): pass
+
+class Recorder:
+    """Appends calls to a trace file; safe to use from several threads"""
+
+    def __init__(self, filename, uri=None):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.file = gzip.open(filename, 'wb')
+        self.dump((MAGIC, VERSION, time.time(), uri))
+        logger.log("plctrace: recording PLC calls in %s" % filename)
+
+    def dump(self, record):
+        cPickle.dump(record, self.file, cPickle.HIGHEST_PROTOCOL)
+        # so that the trace is usable even if nodemanager gets killed
+        self.file.flush()
+
+    def record(self, method, params, started, latency, outcome, value):
+        self.lock.acquire()
+        try:
+            try:
+                self.dump((method, params, started, latency, outcome, value))
+                self.calls += 1
+            except Exception, e:
+                logger.log("plctrace: could not record %s: %r" % (method, e))
+        finally: self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try: self.file.close()
+        finally: self.lock.release()
+
+
+class RecordingServer:
+    """Wraps an XML-RPC proxy, and records the calls made through it"""
+
+    def __init__(self, server, recorder):
+        self.server = server
+        self.recorder = recorder
+
+    def __getattr__(self, method):
+        function = getattr(self.server, method)
+        recorder = self.recorder
+        def recorded(*params):
+            # the first parameter is the auth struct, it is not worth keeping
+            started = time.time()
+            try:
+                result = function(*params)
+            except xmlrpclib.Fault, fault:
+                recorder.record(method, params[1:], started, time.time() - started,
+                                'fault', (fault.faultCode, fault.faultString))
+                raise
+            except:
+                recorder.record(method, params[1:], started, time.time() - started,
+                                'error', repr(sys.exc_info()[1]))
+                raise
+            recorder.record(method, params[1:], started, time.time() - started, 'ok', result)
+            return result
+        return recorded
+
+
+def load(filename):
+    """Return the header and the list of calls stored in <filename>"""
+    f = gzip.open(filename, 'rb')
+    try:
+        try:
+            header = cPickle.load(f)
+        except Exception, e:
+            raise TraceError("%s: cannot read header: %r" % (filename, e))
+        if not isinstance(header, tuple) or header[0] != MAGIC:
+            raise TraceError("%s: not a trace file" % filename)
+        if header[1] != VERSION:
+            raise TraceError("%s: unsupported trace version %r" % (filename, header[1]))
+        calls = []
+        while True:
+            try:
+                calls.append(cPickle.load(f))
+            except EOFError:
+                break
+            except Exception, e:
+                # e.g. the recording nodemanager got killed while writing
+                logger.log("plctrace: %s is truncated after %d calls (%r)" % (filename, len(calls), e))
+                break
+        return (header, calls)
+    finally: f.close()
+
+
+class Player:
+    """Stands in for the XML-RPC proxy, and answers calls from a trace"""
+
+    def __init__(self, filename, fast=False):
+        (self.header, calls) = load(filename)
+        self.filename = filename
+        self.fast = fast
+        self.lock = threading.Lock()
+        # method -> calls not replayed yet, in recorded order
+        self.pending = {}
+        for call in calls:
+            self.pending.setdefault(call[0], []).append(call)
+        # recorded and actual start of the last GetSlivers replayed
+        self.last_recorded = None
+        self.last_replayed = None
+        logger.log("plctrace: replaying %d PLC calls from %s%s" % \
+                       (len(calls), filename, (fast and " (fast)") or ""))
+
+    def next(self, method):
+        self.lock.acquire()
+        try:
+            calls = self.pending.get(method)
+            if not calls:
+                raise EndOfTrace("%s: no more recorded %s calls" % (self.filename, method))
+            call = calls.pop(0)
+            if method == 'GetSlivers':
+                self.last_recorded = call[2]
+                self.last_replayed = time.time()
+            return call
+        finally: self.lock.release()
+
+    def remaining(self, method):
+        """How many calls to <method> are left in the trace"""
+        self.lock.acquire()
+        try: return len(self.pending.get(method, []))
+        finally: self.lock.release()
+
+    def delay(self):
+        """How long to wait before the next GetSlivers, to keep to the recorded pace"""
+        if self.fast: return 0
+        self.lock.acquire()
+        try:
+            calls = self.pending.get('GetSlivers')
+            if not calls or self.last_recorded is None: return 0
+            gap = calls[0][2] - self.last_recorded
+            return max(0, gap - (time.time() - self.last_replayed))
+        finally: self.lock.release()
+
+    def __getattr__(self, method):
+        if method.startswith('_'): raise AttributeError, method
+        def replayed(*params):
+            (name, recorded_params, started, latency, outcome, value) = self.next(method)
+            if params[1:] != tuple(recorded_params):
+                logger.verbose("plctrace: %s called with %r, recorded with %r" % (method, params[1:], recorded_params))
+            if not self.fast and latency > 0:
+                time.sleep(latency)
+            if outcome == 'fault':
+                raise xmlrpclib.Fault(value[0], value[1])
+            elif outcome == 'error':
+                raise TraceError("%s: replayed error %s" % (method, value))
+            return value
+        return replayed
+
+
+class RecordingPLCAPI(PLCAPI):
+    """A PLCAPI that records all calls with <recorder>"""
+
+    def __init__(self, recorder, *args, **kwds):
+        self.recorder = recorder
+        PLCAPI.__init__(self, *args, **kwds)
+
+    def make_server(self):
+        return RecordingServer(PLCAPI.make_server(self), self.recorder)
+
+
+class ReplayingPLCAPI(PLCAPI):
+    """A PLCAPI that gets its answers from <player> instead of PLC"""
+
+    def __init__(self, player, *args, **kwds):
+        self.player = player
+        PLCAPI.__init__(self, *args, **kwds)
+
+    def make_server(self):
+        return self.player
+
+    def add_auth(self, function):
+        # nothing checks the auth struct, and there may be no credentials to compute it from
+        def wrapper(*params):
+            return function(None, *params)
+        return wrapper
+
+    def check_authentication(self):
+        # the recorded session is most likely gone by now, and does not matter
+        return True
+
+    def update_session(self, *args):
+        pass
@@ -7,7 +7,10 @@ import shutil
 
 import logger
 import tools
+import sliversview
 
+# installing/updating DistributedRateLimiting through yum may take a while
+timeout = 1800
 
 drl = """<?xml version="1.0" encoding="UTF-8"?>
 <!-- %s -->
@@ -70,13 +73,11 @@ def GetSlivers(data, conf = None, plc = None):
         logger.log_missing_data("drl.GetSlivers",'slivers')
         return
 
-    for sliver in data['slivers']:
-        for attribute in sliver['attributes']:
-            tag = attribute['tagname']
-            value = attribute['value']
-            if tag == 'drl' and value == '1':
-                HAVE_DRL = 1
-                DRL_SLICE_NAME = sliver['name']
+    view = sliversview.get(data)
+    for sliver in view.with_tag('drl'):
+        if '1' in view.values(sliver['name'], 'drl'):
+            HAVE_DRL = 1
+            DRL_SLICE_NAME = sliver['name']
 
     if HAVE_DRL:
         site_id = plc.GetNodes({'node_id': int(node_id) }, ['site_id'])
@@ -12,6 +12,7 @@ import subprocess
 
 import tools
 import logger
+import sliversview
 
 priority = 50
 
@@ -44,40 +45,38 @@ def GetSlivers(data, conf = None, plc = None):
         logger.log("Failed to read hrn from GetSlivers, using 'default' - *please upgrade PLCAPI*")
         node_hrn='default   # Failed to read hrn from GetSlivers, please upgrade PLCAPI'
 
-    for sliver in data['slivers']:
+    for sliver in sliversview.get(data).with_tag('omf_control'):
         name=sliver['name']
         sliver_pub_key_dir=os.path.join("/home", name, ".ssh/")
         sliver_private_key=os.path.join(sliver_pub_key_dir, "id_rsa")
-        for chunk in sliver['attributes']:
-            if chunk['tagname']=='omf_control':
-                # scan all versions of omf-resctl
-                etc_path="/vservers/%s/etc/"%name
-                pattern = etc_path + "omf-resctl-*/omf-resctl.yaml.in"
-                templates = glob.glob (pattern)
-                if not templates:
-                    logger.log("WARNING: omf_resctl plugin, no template found for slice %s using pattern %s"\
-                                   %(name,pattern))
-                    continue
-                for template in templates:
-                    # remove the .in extension
-                    yaml=template[:-3]
-                    # figure service name as subdir under etc/
-                    service_name=os.path.split(template.replace(etc_path,''))[0]
-                    # read template and replace
-                    template_contents=file(template).read()
-                    yaml_contents=template_contents\
-                        .replace('@XMPP_SERVER@',xmpp_server)\
-                        .replace('@NODE_HRN@',node_hrn)\
-                        .replace('@SLICE_NAME@',name)\
-                        .replace('@SLIVER_PRIVATE_KEY@',sliver_private_key)\
-                        .replace('@SLIVER_PUB_KEY_DIR@',sliver_pub_key_dir)
-                    changes=tools.replace_file_with_string(yaml,yaml_contents)
-                    logger.log("yaml_contents length=%d, changes=%r"%(len(yaml_contents),changes))
-                    if changes:
-                        sp=subprocess.Popen(['vserver',name,'exec','service',service_name,'restart'],
-                                            stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
-                        (output,retcod)=sp.communicate()
-                        logger.log("omf_resctl: %s: restarted resource controller (retcod=%r)"%(name,retcod))
-                        logger.log("omf_resctl: got output\n%s"%output)
-                    else:
-                        logger.log("omf_resctl: %s: omf_control'ed sliver has no change" % name)
+        # scan all versions of omf-resctl
+        etc_path="/vservers/%s/etc/"%name
+        pattern = etc_path + "omf-resctl-*/omf-resctl.yaml.in"
+        templates = glob.glob (pattern)
+        if not templates:
+            logger.log("WARNING: omf_resctl plugin, no template found for slice %s using pattern %s"\
+                           %(name,pattern))
+            continue
+        for template in templates:
+            # remove the .in extension
+            yaml=template[:-3]
+            # figure service name as subdir under etc/
+            service_name=os.path.split(template.replace(etc_path,''))[0]
+            # read template and replace
+            template_contents=file(template).read()
+            yaml_contents=template_contents\
+                .replace('@XMPP_SERVER@',xmpp_server)\
+                .replace('@NODE_HRN@',node_hrn)\
+                .replace('@SLICE_NAME@',name)\
+                .replace('@SLIVER_PRIVATE_KEY@',sliver_private_key)\
+                .replace('@SLIVER_PUB_KEY_DIR@',sliver_pub_key_dir)
+            changes=tools.replace_file_with_string(yaml,yaml_contents)
+            logger.log("yaml_contents length=%d, changes=%r"%(len(yaml_contents),changes))
+            if changes:
+                sp=subprocess.Popen(['vserver',name,'exec','service',service_name,'restart'],
+                                    stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+                (output,retcod)=sp.communicate()
+                logger.log("omf_resctl: %s: restarted resource controller (retcod=%r)"%(name,retcod))
+                logger.log("omf_resctl: got output\n%s"%output)
+            else:
+                logger.log("omf_resctl: %s: omf_control'ed sliver has no change" % name)
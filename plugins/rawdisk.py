@@ -20,6 +20,7 @@ import re
 
 import logger
 import tools
+import sliversview
 
 def start():
     logger.log("rawdisk: plugin starting up...")
@@ -58,25 +59,22 @@ def GetSlivers(data, config=None, plc=None):
         return
 
     devices = get_unused_devices()
-    for sliver in data['slivers']:
-        for attribute in sliver['attributes']:
-            name = attribute.get('tagname',attribute.get('name',''))
-            if name == 'rawdisk':
-                for i in devices:
-                    st = os.stat(i)
-                    path = "/vservers/%s%s" % (sliver['name'], i)
-                    if os.path.exists(path):
-                        # should check whether its the proper type of device
-                        continue
+    for sliver in sliversview.get(data).with_tag('rawdisk'):
+        for i in devices:
+            st = os.stat(i)
+            path = "/vservers/%s%s" % (sliver['name'], i)
+            if os.path.exists(path):
+                # should check whether its the proper type of device
+                continue
 
-                    logger.log("rawdisk: Copying %s to %s" % (i, path))
-                    try:
-                        if os.path.exists(path):
-                            os.unlink(path)
-                    except:
-                        pass
-                    try:
-                        os.makedirs(os.path.dirname(path), 0755)
-                    except:
-                        pass
-                    os.mknod(path, st.st_mode, st.st_rdev)
+            logger.log("rawdisk: Copying %s to %s" % (i, path))
+            try:
+                if os.path.exists(path):
+                    os.unlink(path)
+            except:
+                pass
+            try:
+                os.makedirs(os.path.dirname(path), 0755)
+            except:
+                pass
+            os.mknod(path, st.st_mode, st.st_rdev)
@@ -13,6 +13,7 @@ import threading
 import logger
 import accounts
 import database
+import sliversview
 
 # there is an implicit assumption that this triggers after slicemanager
 priority = 45
@@ -251,14 +252,12 @@ class reservation:
     # this probably should run in parallel
     def suspend_all_slices (self, exclude=[]):
         if isinstance(exclude,str): exclude=[exclude,]
+        view=sliversview.get(self.data)
         for sliver in self.data['slivers']:
             # skip excluded
             if sliver['name'] in exclude: continue
             # is this a system sliver ?
-            system_slice=False
-            for d in sliver['attributes']:
-                if d['tagname']=='system' and d['value'] : system_slice=True
-            if system_slice: continue
+            if [ value for value in view.values(sliver['name'],'system') if value ]: continue
             self.suspend_slice(sliver['name'])
 
     def restart_slice(self, slicename):
@@ -267,10 +266,15 @@ class reservation:
         worker=accounts.get(slicename)
         try:
             # dig in self.data to retrieve corresponding rec
-            slivers = [ sliver for sliver in self.data['slivers'] if sliver['name']==slicename ]
-            sliver=slivers[0]
-            record=database.db.get(slicename)
-            record['enabled']=True
+            sliver=sliversview.get(self.data).sliver(slicename)
+            if sliver is None: raise KeyError(slicename)
+            database.db_lock.acquire()
+            try:
+                record=database.db.get(slicename)
+                record['enabled']=True
+                # so that the published snapshot and the journal get the change too
+                database.db.mark_dirty(slicename)
+            finally: database.db_lock.release()
             #
             logger.log("reservation: Located worker object %r"%worker)
             logger.log("reservation: Located record at the db %r"%record)
@@ -22,6 +22,7 @@ import socket
 
 import logger
 import tools
+import sliversview
 
 def start():
     logger.log("sliverauth: (dummy) plugin starting up...")
@@ -36,6 +37,7 @@ def GetSlivers(data, config, plc):
         logger.log_missing_data("sliverauth.GetSlivers", 'slivers')
         return
 
+    view = sliversview.get(data)
     for sliver in data['slivers']:
         path = '/vservers/%s' % sliver['name']
         if not os.path.exists(path):
@@ -45,18 +47,11 @@ def GetSlivers(data, config, plc):
                 logger.log("sliverauth: plc-instantiated slice %s does not yet exist. IGNORING!" % sliver['name'])
             continue
 
-        system_slice = False
-        for chunk in sliver['attributes']:
-            if chunk['tagname'] == "system":
-                if chunk['value'] in (True, 1, '1') or chunk['value'].lower() == "true":
-                    system_slice = True
+        if view.has_tag(sliver['name'], 'enable_hmac') and not view.is_system(sliver['name']):
+            manage_hmac (plc, sliver)
 
-        for chunk in sliver['attributes']:
-            if chunk['tagname']=='enable_hmac' and not system_slice:
-                manage_hmac (plc, sliver)
-
-            if chunk['tagname']=='omf_control':
-                manage_sshkey (plc, sliver)
+        if view.has_tag(sliver['name'], 'omf_control'):
+            manage_sshkey (plc, sliver)
 
 
 def SetSliverTag(plc, slice, tagname, value):
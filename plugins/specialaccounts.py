@@ -25,14 +25,21 @@ import tools
 # right after conf_files
 priority = 3
 
+# we only depend on the 'accounts' key, so we can skip cycles where it has not changed
+use_changeset = True
+
 def start():
     logger.log("specialaccounts: plugin starting up...")
 
-def GetSlivers(data, conf = None, plc = None):
+def GetSlivers(data, conf = None, plc = None, changes = None):
     if 'accounts' not in data:
         logger.log_missing_data("specialaccounts.GetSlivers",'accounts')
         return
 
+    if changes is not None and not changes.global_changed('accounts'):
+        logger.verbose("specialaccounts: accounts unchanged, skipping")
+        return
+
     for account in data['accounts']:
         name = account['name']
         new_keys = account['keys']
@@ -5,6 +5,7 @@
 
 import logger
 import os
+import sliversview
 
 VSYSCONF="/etc/vsys.conf"
 VSYSBKEND="/vsys"
@@ -29,15 +30,14 @@ def GetSlivers(data, config=None, plc=None):
     if 'slivers' not in data:
         logger.log_missing_data("vsys.GetSlivers",'slivers')
         return
-    for sliver in data['slivers']:
-        for attribute in sliver['attributes']:
-            if attribute['tagname'] == 'vsys':
-                if sliver['name'] not in slices:
-                    # add to conf
-                    slices.append(sliver['name'])
-                    _restart = createVsysDir(sliver['name']) or _restart
-                if attribute['value'] in scripts.keys():
-                    scripts[attribute['value']].append(sliver['name'])
+    view = sliversview.get(data)
+    for sliver in view.with_tag('vsys'):
+        # add to conf
+        slices.append(sliver['name'])
+        _restart = createVsysDir(sliver['name']) or _restart
+        for value in view.values(sliver['name'], 'vsys'):
+            if value in scripts:
+                scripts[value].append(sliver['name'])
 
     # Write the conf
     _restart = writeConf(slices, parseConf()) or _restart
@@ -9,21 +9,30 @@ node for the reference of vsys scripts.
 
 import logger
 import os
+import sliversview
 
 VSYS_PRIV_DIR = "/etc/planetlab/vsys-attributes"
 
+# we only depend on the vsys_ tags, so we can skip cycles where none has changed
+use_changeset = True
+
 def start():
     logger.log("vsys_privs: plugin starting")
     if (not os.path.exists(VSYS_PRIV_DIR)):
         os.makedirs(VSYS_PRIV_DIR)
         logger.log("vsys_privs: Created vsys attributes dir")
 
-def GetSlivers(data, config=None, plc=None):
+def GetSlivers(data, config=None, plc=None, changes=None):
 
     if 'slivers' not in data:
         logger.log_missing_data("vsys_privs.GetSlivers",'slivers')
         return
 
+    if changes is not None:
+        if not [ tag for tag in changes.tags_changed() if tag.startswith('vsys_') ]:
+            logger.verbose("vsys_privs: no vsys_ tag has changed, skipping")
+            return
+
 
     privs = {}
 
@@ -31,22 +40,13 @@ def GetSlivers(data, config=None, plc=None):
     if 'slivers' not in data:
         logger.log_missing_data("vsys_privs.GetSlivers",'slivers')
         return
-    for sliver in data['slivers']:
+    view = sliversview.get(data)
+    for sliver in view.with_tag_prefix('vsys_'):
         slice = sliver['name']
-        for attribute in sliver['attributes']:
-            tag = attribute['tagname']
-            value = attribute['value']
+        privs[slice] = {}
+        for (tag, values) in view.tags(slice).items():
             if tag.startswith('vsys_'):
-                if (privs.has_key(slice)):
-                    slice_priv = privs[slice]
-                    if (slice_priv.has_key(tag)):
-                        slice_priv[tag].append(value)
-                    else:
-                        slice_priv[tag]=[value]
-
-                    privs[slice] = slice_priv
-                else:
-                    privs[slice] = {tag:[value]}
+                privs[slice][tag] = values[:]
 
     cur_privs = read_privs()
     write_privs(cur_privs, privs)
@@ -0,0 +1,79 @@
+"""Adaptive polling of PLC.
+
+When GetSlivers() keeps failing, there is no point in hammering PLC
+on the usual schedule: the base polling interval is doubled after each
+consecutive failure, up to max_backoff, and goes back to normal after
+the first success.  The random part that is added to the base interval
+is scaled in the same way, so that nodes that failed together (e.g.
+during a PLC outage) don't all retry together.
+
+The timeout for PLC calls is derived from the measured response times
+of the last successful GetSlivers() calls (timeout_factor times the
+slowest of them), within [min_timeout, max_timeout].  After a failure,
+the timeout is doubled, in case PLC has just become slower.
+"""
+
+import random
+
+import logger
+import cyclestats
+
+class PollPolicy:
+
+    # how many response times we keep
+    window = 10
+    timeout_factor = 3
+
+    def __init__(self, period, jitter, max_backoff, min_timeout, max_timeout):
+        self.period = period
+        self.jitter = jitter
+        self.max_backoff = max(period, max_backoff)
+        self.min_timeout = min_timeout
+        self.max_timeout = max(min_timeout, max_timeout)
+        # consecutive failures
+        self.failures = 0
+        # response times of the last successful calls
+        self.latencies = []
+        self.timeout = self.max_timeout
+
+    def success(self, latency):
+        if self.failures:
+            logger.log("pollpolicy: GetSlivers succeeded after %d failure(s) - back to normal polling" % self.failures)
+        self.failures = 0
+        self.latencies.append(latency)
+        if len(self.latencies) > self.window: del self.latencies[0]
+        self.timeout = max(self.min_timeout, min(self.max_timeout, int(self.timeout_factor * max(self.latencies))))
+        self.report()
+
+    def failure(self):
+        self.failures += 1
+        self.timeout = min(self.max_timeout, self.timeout * 2)
+        logger.log("pollpolicy: GetSlivers failed %d time(s) in a row - backing off to %d s (timeout %d s)" % \
+                       (self.failures, self.base_delay(), self.timeout))
+        self.report()
+
+    def base_delay(self):
+        if not self.failures: return self.period
+        # avoid computing huge powers of 2 when PLC is down for long
+        return min(self.max_backoff, self.period * 2 ** min(self.failures, 16))
+
+    def delay(self):
+        """Return the number of seconds to wait until the next poll"""
+        base = self.base_delay()
+        jitter = self.jitter * base / self.period
+        if jitter > 0: return base + random.randrange(0, jitter)
+        return base
+
+    def expected_latency(self):
+        """How long we expect the next GetSlivers() to take - on the safe side"""
+        if not self.latencies: return self.timeout
+        return int(1.5 * max(self.latencies)) + 1
+
+    def report(self):
+        cyclestats.set_value('poll.failures', self.failures)
+        cyclestats.set_value('poll.base_delay', self.base_delay())
+        cyclestats.set_value('poll.timeout', self.timeout)
+
+    def __repr__(self):
+        return "<PollPolicy period=%d jitter=%d max_backoff=%d failures=%d timeout=%d>" % \
+            (self.period, self.jitter, self.max_backoff, self.failures, self.timeout)
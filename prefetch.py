@@ -0,0 +1,93 @@
+"""Fetching the next GetSlivers() ahead of time.
+
+On high-latency links to PLC, the GetSlivers() round-trip is a large
+part of each cycle, yet it does not depend on the modules' callbacks.
+When nodemanager runs with --prefetch, a Prefetcher issues the next
+call in a background thread, so that it completes right when the next
+cycle is due, possibly while the current data is still being applied.
+"""
+
+import sys
+import time
+import threading
+
+import logger
+import cyclestats
+
+class Fetch:
+    """The outcome of one GetSlivers() call made in the background"""
+    def __init__(self, started):
+        self.started = started
+        self.done = threading.Event()
+        self.latency = None
+        self.data = None
+        self.exc_info = None
+
+    def result(self):
+        """Return the data, or raise the exception that the call raised"""
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.data
+
+
+class Prefetcher:
+
+    def __init__(self, plc, max_age):
+        self.plc = plc
+        # results older than this are not worth using
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.timer = None
+        self.fetch = None
+        self.cancelled = False
+
+    def schedule(self, when):
+        """Arrange for GetSlivers() to be called at time <when>"""
+        self.lock.acquire()
+        try:
+            if self.timer: self.timer.cancel()
+            self.fetch = None
+            self.cancelled = False
+            delay = max(0, when - time.time())
+            logger.verbose("prefetch: next GetSlivers scheduled in %d s" % delay)
+            self.timer = threading.Timer(delay, self.run)
+            self.timer.setDaemon(True)
+            self.timer.start()
+        finally: self.lock.release()
+
+    def run(self):
+        self.lock.acquire()
+        try:
+            if self.cancelled: return
+            fetch = self.fetch = Fetch(time.time())
+        finally: self.lock.release()
+        try:
+            fetch.data = self.plc.GetSlivers()
+        except:
+            fetch.exc_info = sys.exc_info()
+        fetch.latency = time.time() - fetch.started
+        cyclestats.record('plc.GetSlivers.prefetch', fetch.latency)
+        fetch.done.set()
+
+    def take(self, not_before=None):
+        """Return the prefetched Fetch, waiting for it if it is in progress.
+Return None if no call was started yet (it then gets cancelled), or if the
+result is too old, or was started before <not_before>."""
+        self.lock.acquire()
+        try:
+            fetch = self.fetch
+            if fetch is None:
+                self.cancelled = True
+                if self.timer: self.timer.cancel()
+            self.timer = None
+            self.fetch = None
+        finally: self.lock.release()
+        if fetch is None: return None
+        fetch.done.wait()
+        if not_before is not None and fetch.started < not_before:
+            logger.verbose("prefetch: discarding GetSlivers started before the sync request")
+            return None
+        if time.time() - fetch.started > self.max_age:
+            logger.verbose("prefetch: discarding GetSlivers fetched %d s ago" % (time.time() - fetch.started))
+            return None
+        return fetch
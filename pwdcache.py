@@ -0,0 +1,94 @@
+"""An in-memory index of the passwd and group databases.
+
+Account lookups happen for every sliver at every sync, and for many
+API calls; with thousands of accounts, or with NSS backends, going
+through the pwd and grp modules each time adds up.  Instead, the whole
+databases are read once, indexed by name, uid and shell, and read again
+only when PASSWD_FILE or GROUP_FILE change, as told by their mtime,
+size and inode.  Names and uids that are not found in the index are
+still looked up through pwd/grp, as these may not be enumerable.
+
+The functions mimic those of the pwd and grp modules, and raise
+KeyError the same way.
+"""
+
+import os
+import pwd
+import grp
+import threading
+
+import logger
+
+PASSWD_FILE = '/etc/passwd'
+GROUP_FILE = '/etc/group'
+
+lock = threading.Lock()
+# file name -> (mtime, size, inode) when the index was built
+stamps = {}
+passwd_by_name = {}
+passwd_by_uid = {}
+passwd_by_shell = {}
+group_by_name = {}
+
+def stamp(filename):
+    try:
+        st = os.stat(filename)
+        return (st.st_mtime, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+def refresh():
+    """Rebuild the indexes if the files changed since they were built"""
+    global passwd_by_name, passwd_by_uid, passwd_by_shell, group_by_name
+    lock.acquire()
+    try:
+        passwd_stamp = stamp(PASSWD_FILE)
+        if 'passwd' not in stamps or stamps['passwd'] != passwd_stamp:
+            by_name = {}
+            by_uid = {}
+            by_shell = {}
+            for pw_ent in pwd.getpwall():
+                by_name[pw_ent[0]] = pw_ent
+                # like getpwuid, the first entry wins
+                by_uid.setdefault(pw_ent[2], pw_ent)
+                by_shell.setdefault(pw_ent[6], []).append(pw_ent)
+            (passwd_by_name, passwd_by_uid, passwd_by_shell) = (by_name, by_uid, by_shell)
+            stamps['passwd'] = passwd_stamp
+            logger.verbose("pwdcache: indexed %d accounts" % len(by_name))
+        group_stamp = stamp(GROUP_FILE)
+        if 'group' not in stamps or stamps['group'] != group_stamp:
+            by_name = {}
+            for gr_ent in grp.getgrall(): by_name[gr_ent[0]] = gr_ent
+            group_by_name = by_name
+            stamps['group'] = group_stamp
+    finally: lock.release()
+
+def invalidate():
+    """Have the next lookup read the databases again, e.g. after adding an account"""
+    lock.acquire()
+    try: stamps.clear()
+    finally: lock.release()
+
+def getpwnam(name):
+    refresh()
+    try: return passwd_by_name[name]
+    except KeyError: return pwd.getpwnam(name)
+
+def getpwuid(uid):
+    refresh()
+    try: return passwd_by_uid[uid]
+    except KeyError: return pwd.getpwuid(uid)
+
+def getpwall():
+    refresh()
+    return passwd_by_name.values()
+
+def getpwshell(shell):
+    """Return the entries of the accounts that use <shell>"""
+    refresh()
+    return passwd_by_shell.get(shell, [])[:]
+
+def getgrnam(name):
+    refresh()
+    try: return group_by_name[name]
+    except KeyError: return grp.getgrnam(name)
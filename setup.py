@@ -19,20 +19,32 @@ setup(
         'api',
         'api_calls',
         'bwmon',
+        'changeset',
         'conf_files',
         'config',
         'controller',
         'coresched',
         'curlwrapper',
+        'cyclestats',
         'database',
+        'diskusage',
         'iptables',
         'logger',
+        'manifest',
         'net',
         'nodemanager',
         'plcapi',
+        'plctrace',
+        'pollpolicy',
+        'prefetch',
+        'pwdcache',
         'safexmlrpc',
         'sliver_vs',
+        'sliverpool',
         'slivermanager',
+        'sliversview',
+        'snapshot',
+        'synctrigger',
         'ticket',
         'tools',
         ],
@@ -6,7 +6,8 @@ There are a couple of tricky things going on here.  First, the kernel
 needs disk usage information in order to enforce the quota.  However,
 determining disk usage redundantly strains the disks.  Thus, the
 Sliver_VS.disk_usage_initialized flag is used to determine whether
-this initialization has been made.
+this initialization has been made, and the figures are kept across
+restarts by the diskusage module.
 
 Second, it's not currently possible to set the scheduler parameters
 for a sliver unless that sliver has a running process.  /bin/vsh helps
@@ -30,8 +31,10 @@ import subprocess
 import vserver
 
 import accounts
+import diskusage
 import logger
 import tools
+import sliverpool
 
 # special constant that tells vserver to keep its existing settings
 KEEP_LIMIT = vserver.VC_LIM_KEEP
@@ -110,18 +113,21 @@ class Sliver_VS(accounts.Account, vserver.VServer):
                 personality="linux64"
             return personality
 
-        command=[]
-        # be verbose
-        command += ['/bin/bash','-x',]
-        command += ['/usr/sbin/vuseradd', ]
-        if 'attributes' in rec and 'isolate_loopback' in rec['attributes'] and rec['attributes']['isolate_loopback'] == '1':
-            command += [ "-i",]
-        # the vsliver imge to use
-        command += [ '-t', vref, ]
-        # slice name
-        command += [ name, ]            
-#        logger.log_call(['/usr/sbin/vuseradd', '-t', vref, name, ], timeout=15*60)
-        logger.log_call(command, timeout=15*60)
+        isolate_loopback = 'attributes' in rec and 'isolate_loopback' in rec['attributes'] and rec['attributes']['isolate_loopback'] == '1'
+        # the pooled vservers are built without -i
+        if isolate_loopback or not sliverpool.claim(vref, name):
+            command=[]
+            # be verbose
+            command += ['/bin/bash','-x',]
+            command += ['/usr/sbin/vuseradd', ]
+            if isolate_loopback:
+                command += [ "-i",]
+            # the vsliver imge to use
+            command += [ '-t', vref, ]
+            # slice name
+            command += [ name, ]
+#            logger.log_call(['/usr/sbin/vuseradd', '-t', vref, name, ], timeout=15*60)
+            logger.log_call(command, timeout=15*60)
         # export slicename to the slice in /etc/slicename
         file('/vservers/%s/etc/slicename' % name, 'w').write(name)
         file('/vservers/%s/etc/slicefamily' % name, 'w').write(vref)
@@ -132,6 +138,7 @@ class Sliver_VS(accounts.Account, vserver.VServer):
 
     @staticmethod
     def destroy(name):
+        diskusage.forget(name)
 #        logger.log_call(['/usr/sbin/vuserdel', name, ])
         logger.log_call(['/bin/bash','-x','/usr/sbin/vuserdel', name, ])
 
@@ -245,22 +252,55 @@ class Sliver_VS(accounts.Account, vserver.VServer):
     def is_running(self):
         return vserver.VServer.is_running(self)
 
+    def compute_disk_usage(self):
+        Sliver_VS._init_disk_info_sem.acquire()
+        logger.log('sliver_vs: %s: computing disk usage: beginning' % self.name)
+        # init_disk_info is inherited from VServer
+        try: self.init_disk_info()
+        finally: Sliver_VS._init_disk_info_sem.release()
+        logger.log('sliver_vs: %s: computing disk usage: ended' % self.name)
+        diskusage.store(self.name, '/vservers/%s' % self.name, self.disk_blocks, self.disk_inodes)
+
+    def refresh_disk_usage(self):
+        """Compute the disk usage again, and apply it - called in the background when the cached figure is stale"""
+        self.compute_disk_usage()
+        # replace the counters that were set from the stale figures
+        self.vm_running = False
+        vserver.VServer.set_disklimit(self, max(self.rspec['disk_max'], self.disk_blocks))
+
+    def has_disklimit(self):
+        """Whether the kernel already counts the disk usage, e.g. nodemanager was restarted but not the node"""
+        try: return vserver.VServer.get_disklimit(self) >= 0
+        except OSError: return False
+
     def set_resources(self):
         disk_max = self.rspec['disk_max']
         logger.log('sliver_vs: %s: setting max disk usage to %d KiB' % (self.name, disk_max))
-        try:  # if the sliver is over quota, .set_disk_limit will throw an exception
-            if not self.disk_usage_initialized:
-                self.vm_running = False
-                Sliver_VS._init_disk_info_sem.acquire()
-                logger.log('sliver_vs: %s: computing disk usage: beginning' % self.name)
-                # init_disk_info is inherited from VServer
-                try: self.init_disk_info()
-                finally: Sliver_VS._init_disk_info_sem.release()
-                logger.log('sliver_vs: %s: computing disk usage: ended' % self.name)
+        try:
+            if self.has_disklimit():
+                # keep the kernel's live counters; get_disklimit has read them in disk_blocks
+                self.vm_running = True
                 self.disk_usage_initialized = True
-            vserver.VServer.set_disklimit(self, max(disk_max, self.disk_blocks))
+            else:
+                self.vm_running = False
+                if not self.disk_usage_initialized:
+                    # e.g. after a reboot, the usage computed before is good enough to start with
+                    cached = diskusage.lookup(self.name, '/vservers/%s' % self.name)
+                    if cached is None:
+                        self.compute_disk_usage()
+                    else:
+                        (self.disk_blocks, self.disk_inodes, fresh) = cached
+                        logger.verbose('sliver_vs: %s: %d disk blocks used, as cached' % (self.name, self.disk_blocks))
+                        if not fresh: diskusage.refresh_later(self.name, self.refresh_disk_usage)
+                    # even if setting the limit fails below, there is no need to walk the tree again
+                    self.disk_usage_initialized = True
         except:
-            logger.log_exc('sliver_vs: failed to set max disk usage',name=self.name)
+            logger.log_exc('sliver_vs: failed to compute disk usage',name=self.name)
+        if self.disk_usage_initialized:
+            try:  # if the sliver is over quota, .set_disk_limit will throw an exception
+                vserver.VServer.set_disklimit(self, max(disk_max, self.disk_blocks))
+            except:
+                logger.log_exc('sliver_vs: failed to set max disk usage',name=self.name)
 
         # get/set the min/soft/hard values for all of the vserver
         # related RLIMITS.  Note that vserver currently only
@@ -17,11 +17,15 @@ import database
 import accounts
 import controller
 import sliver_vs
+import sliverpool
+import sliversview
 
 try: from bwlimit import bwmin, bwmax
 except ImportError: bwmin, bwmax = 8, 1000*1000*1000
 
 priority=10
+# creating a sliver may take up to 15 minutes, and there may be several of them
+timeout=3600
 
 
 DEFAULT_ALLOCATION = {
@@ -80,11 +84,9 @@ def adjustReservedSlivers (data):
             active_lease=lease
             break
 
+    view = sliversview.get(data)
     def is_system_sliver (sliver):
-        for d in sliver['attributes']:
-            if d['tagname']=='system' and d['value']:
-                return True
-        return False
+        return [ value for value in view.values(sliver['name'],'system') if value ]
 
     # mark slivers as appropriate
     for sliver in data['slivers']:
@@ -138,14 +140,18 @@ def GetSlivers(data, config = None, plc=None, fullupdate=True):
         iscripts_hash[str(initscript_rec['name'])] = initscript_rec['script']
 
     adjustReservedSlivers (data)
+    view = sliversview.get(data)
+    # the reference images in use, for the pool of pre-built vservers
+    vrefs = {}
     for sliver in data['slivers']:
         logger.verbose("slivermanager: %s: slivermanager.GetSlivers in slivers loop"%sliver['name'])
         rec = sliver.copy()
         rec.setdefault('timestamp', data['timestamp'])
 
-        # convert attributes field to a proper dict
+        # convert attributes field to a proper dict - the last value wins for multi-valued tags
         attributes = {}
-        for attr in rec.pop('attributes'): attributes[attr['tagname']] = attr['value']
+        for (tag, values) in view.tags(sliver['name']).iteritems(): attributes[tag] = values[-1]
+        del rec['attributes']
         rec.setdefault("attributes", attributes)
 
         # squash keys
@@ -196,7 +202,14 @@ def GetSlivers(data, config = None, plc=None, fullupdate=True):
         # also export tags in rspec so they make it to the sliver_vs.start call
         rspec['tags']=attributes
 
+        if rec['type'] == sliver_vs.Sliver_VS.TYPE: vrefs[rec['vref']] = True
         database.db.deliver_record(rec)
+    if config is not None and fullupdate:
+        pool_size = 0
+        if 'OVERRIDES' in dir(config):
+            try: pool_size = int(config.OVERRIDES.get('sliver_pool', 0))
+            except ValueError: logger.log("slivermanager: ignoring invalid sliver_pool %r" % config.OVERRIDES['sliver_pool'])
+        sliverpool.configure(pool_size, vrefs.keys())
     if fullupdate: database.db.set_min_timestamp(data['timestamp'])
     # slivers are created here.
     database.db.sync()
@@ -0,0 +1,202 @@
+"""A pool of pre-built vservers, for faster sliver creation.
+
+Creating a vserver with vuseradd copies the whole reference image, and
+is by far the slowest step in bringing up a new slice.  When the
+_default slice has a 'sliver_pool' tag, that many vservers are kept
+ready for each reference image in use on the node.  They are built in
+the background, at the lowest CPU and I/O priorities, under placeholder
+names (POOL_PREFIX followed by a number); Sliver_VS.create then only
+has to claim one, rename it and personalize it.  The pool refills
+itself after each claim, and shrinks when the tag goes away.
+
+The ready vservers are found again after a restart from their names;
+their /etc/slicefamily tells their reference image, and is only written
+once vuseradd has completed, so incomplete ones get destroyed.
+"""
+
+import os
+import re
+import stat
+import threading
+
+import logger
+import tools
+import pwdcache
+import cyclestats
+
+POOL_PREFIX = 'nmpool'
+# so as not to slow down the slivers while building
+LOW_PRIORITY = ['/bin/nice', '-n', '19', '/usr/bin/ionice', '-c', '3']
+BUILD_TIMEOUT = 15*60
+
+placeholder_re = re.compile('^%s[0-9]+$' % POOL_PREFIX)
+
+lock = threading.Lock()
+# vref -> how many vservers to keep ready
+targets = {}
+# vref -> names of the vservers ready to be claimed
+ready = {}
+# set when there may be something to build or destroy
+wakeup = threading.Event()
+started = False
+
+def owns(name):
+    """Whether account <name> is one of the pool's placeholders"""
+    return placeholder_re.match(name) is not None
+
+def placeholders():
+    return [ pw_ent[0] for pw_ent in pwdcache.getpwall() if owns(pw_ent[0]) ]
+
+def configure(size, vrefs):
+    """Keep <size> vservers ready for each reference image in <vrefs>"""
+    global started
+    new_targets = {}
+    if size > 0:
+        for vref in vrefs: new_targets[vref] = size
+    lock.acquire()
+    try:
+        if new_targets != targets:
+            logger.verbose("sliverpool: keeping %r" % new_targets)
+            targets.clear()
+            targets.update(new_targets)
+        # no need for a thread until the pool gets used
+        if not started:
+            if not new_targets and not placeholders(): return
+            started = True
+            tools.as_daemon_thread(run)
+    finally: lock.release()
+    # once per cycle, so that failed builds get retried
+    wakeup.set()
+
+def claim(vref, name):
+    """Make a ready vserver built from <vref> into sliver <name>; return False if there was none, or it failed"""
+    lock.acquire()
+    try:
+        if not ready.get(vref):
+            if targets.get(vref): cyclestats.incr('sliverpool.misses')
+            return False
+        placeholder = ready[vref].pop(0)
+    finally: lock.release()
+    wakeup.set()
+    logger.log("sliverpool: %s: using pre-built %s" % (name, placeholder))
+    try:
+        rename(placeholder, name)
+        cyclestats.incr('sliverpool.claims')
+        return True
+    except:
+        logger.log_exc("sliverpool: could not rename %s" % placeholder, name=name)
+        # start over from a clean slate
+        destroy(placeholder)
+        destroy(name)
+        return False
+
+def rename(old, new):
+    """Rename account and vserver <old> into <new>, as if vuseradd had created <new>"""
+    if not logger.log_call(['/usr/sbin/usermod', '-l', new, '-d', '/home/%s' % new, '-m', old]):
+        raise Exception("usermod failed")
+    pwdcache.invalidate()
+    os.rename('/vservers/%s' % old, '/vservers/%s' % new)
+    os.rename('/etc/vservers/%s' % old, '/etc/vservers/%s' % new)
+    config_dir = '/etc/vservers/%s' % new
+    vdir = os.path.join(config_dir, 'vdir')
+    if os.path.islink(vdir):
+        os.unlink(vdir)
+        os.symlink('/vservers/%s' % new, vdir)
+    for path in ('name', 'uts/nodename'):
+        path = os.path.join(config_dir, path)
+        if os.path.isfile(path) and file(path).read().strip() == old:
+            tools.replace_file_with_string(path, new + "\n")
+    # the slice account inside the vserver
+    guest = '/vservers/%s' % new
+    if os.path.isdir('%s/home/%s' % (guest, old)):
+        os.rename('%s/home/%s' % (guest, old), '%s/home/%s' % (guest, new))
+    for path in ('etc/passwd', 'etc/shadow', 'etc/group'):
+        rename_user(os.path.join(guest, path), old, new)
+
+def rename_user(filename, old, new):
+    """Rename user <old> into <new> in passwd, shadow or group file <filename>"""
+    try: lines = file(filename).readlines()
+    except IOError: return
+    result = []
+    for line in lines:
+        fields = line.rstrip('\n').split(':')
+        if fields[0] == old: fields[0] = new
+        # the home directory in passwd
+        if len(fields) == 7 and fields[5] == '/home/%s' % old: fields[5] = '/home/%s' % new
+        # the members in group
+        if len(fields) == 4:
+            fields[3] = ','.join([ (member == old and new) or member for member in fields[3].split(',') ])
+        result.append(':'.join(fields) + '\n')
+    mode = stat.S_IMODE(os.stat(filename).st_mode)
+    tools.replace_file_with_string(filename, ''.join(result), chmod=mode)
+
+def build(vref, name):
+    logger.log("sliverpool: building %s from %s" % (name, vref))
+    command = LOW_PRIORITY + ['/bin/bash', '-x', '/usr/sbin/vuseradd', '-t', vref, name]
+    if not logger.log_call(command, timeout=BUILD_TIMEOUT):
+        destroy(name)
+        return False
+    pwdcache.invalidate()
+    # this tells the vserver is complete
+    file('/vservers/%s/etc/slicefamily' % name, 'w').write(vref)
+    return True
+
+def destroy(name):
+    logger.log_call(['/bin/bash', '-x', '/usr/sbin/vuserdel', name])
+    pwdcache.invalidate()
+
+def built_vref(name):
+    """The reference image vserver <name> was built from, or None if it is not complete"""
+    try: return file('/vservers/%s/etc/slicefamily' % name).read().strip() or None
+    except IOError: return None
+
+def next_job():
+    """Return (action, vref, name) for what the pool needs next, or None"""
+    lock.acquire()
+    try:
+        for (vref, names) in ready.items():
+            if len(names) > targets.get(vref, 0): return ('destroy', vref, names.pop())
+        for (vref, size) in targets.items():
+            if len(ready.get(vref, [])) < size:
+                taken = placeholders()
+                index = 0
+                while '%s%d' % (POOL_PREFIX, index) in taken: index += 1
+                return ('build', vref, '%s%d' % (POOL_PREFIX, index))
+        return None
+    finally: lock.release()
+
+def run():
+    """The builder thread"""
+    for name in placeholders():
+        vref = built_vref(name)
+        if vref is None:
+            logger.log("sliverpool: destroying incomplete %s" % name)
+            destroy(name)
+        else:
+            lock.acquire()
+            try: ready.setdefault(vref, []).append(name)
+            finally: lock.release()
+    while True:
+        wakeup.wait()
+        wakeup.clear()
+        while True:
+            job = next_job()
+            if job is None: break
+            (action, vref, name) = job
+            try:
+                if action == 'destroy':
+                    logger.log("sliverpool: destroying %s, not needed anymore" % name)
+                    destroy(name)
+                elif build(vref, name):
+                    lock.acquire()
+                    try: ready.setdefault(vref, []).append(name)
+                    finally: lock.release()
+                else:
+                    # e.g. the reference image is broken: do not retry right away
+                    break
+            except:
+                logger.log_exc("sliverpool: %s of %s failed" % (action, name))
+                break
+        lock.acquire()
+        try: cyclestats.set_value('sliverpool.ready', sum([ len(names) for names in ready.values() ]))
+        finally: lock.release()
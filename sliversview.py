@@ -0,0 +1,105 @@
+"""An indexed, read-only view of GetSlivers.
+
+Most modules are after a few tags only, and used to scan every
+attribute of every sliver to find them.  A SliversView indexes the
+data once: slivers by name, each sliver's tags as a dict tagname ->
+list of values, and the reverse index tagname -> slivers that have it.
+
+nodemanager.py builds the view once per cycle, after it is done
+tweaking the data; modules get it with
+
+  view = sliversview.get(data)
+  for sliver in view.with_tag('codemux'): ...
+
+The view reflects the data at the time it was built, and must not be
+modified.
+"""
+
+import threading
+
+from changeset import tagname
+
+class SliversView:
+
+    def __init__(self, data):
+        self.data = data
+        # in the order of data['slivers']
+        self.slivers = data.get('slivers', [])
+        # name -> sliver
+        self.by_name = {}
+        # name -> { tagname -> [values] }
+        self.tags_by_name = {}
+        # tagname -> [slivers]
+        self.by_tag = {}
+        for sliver in self.slivers:
+            name = sliver['name']
+            self.by_name[name] = sliver
+            tags = {}
+            for attribute in sliver.get('attributes', []):
+                tag = tagname(attribute)
+                if tag not in tags:
+                    tags[tag] = []
+                    self.by_tag.setdefault(tag, []).append(sliver)
+                tags[tag].append(attribute['value'])
+            self.tags_by_name[name] = tags
+
+    def names(self):
+        return [sliver['name'] for sliver in self.slivers]
+
+    def sliver(self, name):
+        """Return the sliver named <name>, or None"""
+        return self.by_name.get(name)
+
+    def tags(self, name):
+        """Return the tags of sliver <name>, as a dict tagname -> [values]"""
+        return self.tags_by_name.get(name, {})
+
+    def values(self, name, tag):
+        """Return all the values of <tag> for sliver <name>"""
+        return self.tags(name).get(tag, [])
+
+    def value(self, name, tag, default=None):
+        """Return the first value of <tag> for sliver <name>, or <default>"""
+        values = self.values(name, tag)
+        if values: return values[0]
+        return default
+
+    def has_tag(self, name, tag):
+        return tag in self.tags(name)
+
+    def with_tag(self, tag):
+        """Return the slivers that have <tag>, in the order of GetSlivers"""
+        return self.by_tag.get(tag, [])
+
+    def with_tag_prefix(self, prefix):
+        """Return the slivers that have at least one tag starting with <prefix>"""
+        names = {}
+        for tag in self.by_tag:
+            if tag.startswith(prefix):
+                for sliver in self.by_tag[tag]: names[sliver['name']] = True
+        return [sliver for sliver in self.slivers if sliver['name'] in names]
+
+    def is_system(self, name):
+        """Whether sliver <name> has a true 'system' tag"""
+        for value in self.values(name, 'system'):
+            if value in (True, 1, '1') or str(value).lower() == 'true':
+                return True
+        return False
+
+    def __repr__(self):
+        return "<SliversView %d slivers, %d tags>" % (len(self.slivers), len(self.by_tag))
+
+
+# the view of the current cycle, modules may run in concurrent threads
+current = None
+current_lock = threading.Lock()
+
+def get(data):
+    """Return the view of <data>, built once for all modules"""
+    global current
+    current_lock.acquire()
+    try:
+        if current is None or current.data is not data:
+            current = SliversView(data)
+        return current
+    finally: current_lock.release()
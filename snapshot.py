@@ -0,0 +1,83 @@
+"""Versioned, checksummed snapshots of python data on disk.
+
+A snapshot file is made of a one-line header
+
+  NMSNAP <version> <sha1 of payload> <length of payload>
+
+followed by the payload, which is the data pickled with the highest
+protocol available.  Files are written atomically with tools.write_file,
+and a truncated or otherwise corrupted file is detected at load time
+rather than silently yielding partial data.
+"""
+
+import cPickle
+try:
+    from hashlib import sha1 as sha
+except ImportError:
+    from sha import sha
+
+import tools
+
+MAGIC = 'NMSNAP'
+VERSION = 1
+
+class SnapshotError(Exception): pass
+
+def encode(data):
+    return cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+
+def checksum(payload):
+    return sha(payload).hexdigest()
+
+def write(filename, payload, payload_checksum=None):
+    """Store an encoded <payload> in <filename>"""
+    if payload_checksum is None: payload_checksum = checksum(payload)
+    header = "%s %d %s %d\n" % (MAGIC, VERSION, payload_checksum, len(payload))
+    def do_write(f):
+        f.write(header)
+        f.write(payload)
+    tools.write_file(filename, do_write)
+
+def dump(filename, data):
+    """Store <data> in <filename>, and return the checksum of its payload"""
+    payload = encode(data)
+    payload_checksum = checksum(payload)
+    write(filename, payload, payload_checksum)
+    return payload_checksum
+
+def parse_header(line):
+    """Return (version, checksum, length) from a header line"""
+    fields = line.split()
+    if len(fields) != 4 or fields[0] != MAGIC:
+        raise SnapshotError("not a snapshot")
+    try: return (int(fields[1]), fields[2], int(fields[3]))
+    except ValueError: raise SnapshotError("malformed header")
+
+def read_checksum(filename):
+    """Return the checksum recorded in <filename>, or None if it can't be read"""
+    try:
+        f = open(filename)
+        try: return parse_header(f.readline())[1]
+        finally: f.close()
+    except (IOError, SnapshotError):
+        return None
+
+def load(filename):
+    """Return the data stored in <filename>.  Raise SnapshotError if the file is corrupted.
+Files that are plain pickles, as written by older versions, are accepted as well."""
+    f = open(filename, 'rb')
+    try: contents = f.read()
+    finally: f.close()
+    if not contents.startswith(MAGIC + ' '):
+        try: return cPickle.loads(contents)
+        except: raise SnapshotError("%s: neither a snapshot nor a pickle" % filename)
+    try: (header, payload) = contents.split('\n', 1)
+    except ValueError: raise SnapshotError("%s: truncated header" % filename)
+    (version, payload_checksum, length) = parse_header(header)
+    if version != VERSION:
+        raise SnapshotError("%s: unsupported version %d" % (filename, version))
+    if len(payload) != length:
+        raise SnapshotError("%s: truncated, got %d bytes out of %d" % (filename, len(payload), length))
+    if checksum(payload) != payload_checksum:
+        raise SnapshotError("%s: checksum mismatch" % filename)
+    return cPickle.loads(payload)
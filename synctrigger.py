@@ -0,0 +1,78 @@
+"""Requests for an early sync with PLC.
+
+The main loop normally syncs every period + random seconds.  A sync
+can be requested sooner in any of the following ways:
+ * sending SIGUSR1 to the node manager (e.g. service nm sync)
+ * touching TRIGGER_FILE
+ * calling SyncNow() on the node manager API
+Requests that arrive while waiting, or while a sync is in progress,
+are merged and result in a single sync; nodemanager.py enforces a
+minimum gap between two syncs.
+"""
+
+import os
+import signal
+import threading
+import time
+
+import logger
+
+TRIGGER_FILE = '/var/run/nodemanager.sync'
+# how often we look for TRIGGER_FILE while waiting
+POLL_PERIOD = 5
+
+requested = threading.Event()
+# the reasons for the pending requests
+reasons = []
+reasons_lock = threading.Lock()
+# signals received; the handler must not take any lock, as it
+# interrupts the main thread, which might be holding one of them
+signals_received = []
+
+def request(reason):
+    """Ask the main loop to sync as soon as possible"""
+    reasons_lock.acquire()
+    try: reasons.append(reason)
+    finally: reasons_lock.release()
+    requested.set()
+
+def collect():
+    """Return (and forget about) the pending requests, if any"""
+    check_signals()
+    check_trigger_file()
+    reasons_lock.acquire()
+    try:
+        result = reasons[:]
+        del reasons[:]
+        requested.clear()
+    finally: reasons_lock.release()
+    return result
+
+def check_trigger_file():
+    if os.path.exists(TRIGGER_FILE):
+        try: os.unlink(TRIGGER_FILE)
+        except OSError: pass
+        request('touch %s' % TRIGGER_FILE)
+
+def check_signals():
+    while signals_received:
+        request('signal %d' % signals_received.pop())
+
+def wait(timeout):
+    """Wait until a sync gets requested or <timeout> seconds have elapsed.
+Return the list of reasons; an empty list means the timeout has expired."""
+    deadline = time.time() + timeout
+    while True:
+        check_signals()
+        check_trigger_file()
+        remaining = deadline - time.time()
+        if requested.isSet() or remaining <= 0: break
+        requested.wait(min(remaining, POLL_PERIOD))
+    return collect()
+
+def install_signal_handler():
+    def handler(signum, frame): signals_received.append(signum)
+    signal.signal(signal.SIGUSR1, handler)
+    # a sync request must not abort a GetSlivers in progress, e.g. the select in curlwrapper
+    if hasattr(signal, 'siginterrupt'): signal.siginterrupt(signal.SIGUSR1, False)
+    logger.verbose("synctrigger: SIGUSR1 triggers a sync")
@@ -46,6 +46,26 @@ def as_daemon_thread(run):
     thr.setDaemon(True)
     thr.start()
 
+def run_concurrently(functions, max_threads):
+    """Call each function in <functions> with no arguments, using at most <max_threads> threads at a time.
+Return when all of them have returned.  Exceptions are the functions' business."""
+    pending = list(functions)
+    pending.reverse()
+    pending_lock = threading.Lock()
+    def worker():
+        while True:
+            pending_lock.acquire()
+            try:
+                if not pending: return
+                function = pending.pop()
+            finally: pending_lock.release()
+            function()
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(max_threads, len(pending))))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads: thread.join()
+
 def close_nonstandard_fds():
     """Close all open file descriptors other than 0, 1, and 2."""
     _SC_OPEN_MAX = 4